@@ -0,0 +1,201 @@
+#! /usr/bin/env python3
+"""
+    Benchmark of the generation pipeline.
+    Times each phase of the generation of every API module, records the
+    peak memory, and compares against a baseline saved by a previous run.
+"""
+
+import sys
+import time
+from os import path
+
+rootDir = path.dirname(path.realpath(__file__))
+regDir = path.join(rootDir, 'registry')
+sys.path.insert(0, regDir)
+
+import gldprof
+from gldgen import DGenerator, typeMappingStats, clearTypeMapping
+from gldreg import loadRegistry, registryLoaders
+
+# phases, in pipeline order, as reported to gldprof. Only the phases of the
+# loader in use are timed. Phases below apiGen are nested in it, and
+# genType/genEnum/genCmd are nested in generateRequiredInterface.
+phases = [
+    "parse",                        # etree.parse of the XML (tree, compact)
+    "parseTree",                    # Registry.parseTree, indexing (tree, compact)
+    "loadStream",                   # iterparse into compact records (stream)
+    "loadCache",                    # load of the cached records (cache)
+    "apiGen",                       # Registry.apiGen, all of what follows
+    "requireAndRemoveFeatures",     # pass 1, markRequired
+    "generateRequiredInterface",    # pass 2, gen* callbacks
+    "genType",                      # DGenerator.genType/parseType
+    "genEnum",                      # DGenerator.genEnum
+    "genCmd",                       # DGenerator.genCmd
+    "endFile",                      # emission of the D module
+    "total",
+]
+
+# loaders - how the registry is loaded: the loaders of gldreg, or cache
+# for a load from a registry cache filled beforehand
+loaders = registryLoaders + [ "cache" ]
+
+# time spent in the generator per feature type, summed by gldreg in the
+# events of generateRequiredInterface
+genDurations = { "typeDuration": "genType", "enumDuration": "genEnum",
+                 "commandDuration": "genCmd" }
+
+# Timings: gldprof hook accumulating the duration of each phase
+class Timings:
+    def __init__(self):
+        self.times = dict.fromkeys(phases, 0.0)
+
+    def __call__(self, event):
+        if event["phase"] in self.times:
+            self.times[event["phase"]] += event["duration"]
+        for key, p in genDurations.items():
+            self.times[p] += event.get(key, 0.0)
+
+# runPipeline - generate the module of opts from the XML
+#   loader - one of loaders
+#   cacheDir - registry cache of the cache loader
+# Returns the Timings of the run.
+def runPipeline(opts, loader, cacheDir=None):
+    timings = Timings()
+    gldprof.addHook(timings)
+    try:
+        start = time.perf_counter()
+        if loader == "cache":
+            reg = loadRegistry(opts.regFile, cacheDir)
+        else:
+            reg = loadRegistry(opts.regFile, loader=loader)
+        reg.setGenerator(DGenerator(reg))
+        reg.apiGen(opts)
+        timings.times["total"] = time.perf_counter() - start
+    finally:
+        gldprof.removeHook(timings)
+    return timings
+
+# peakMemory - peak of memory allocated by the generation of opts, in bytes
+def peakMemory(opts, loader, cacheDir=None):
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        runPipeline(opts, loader, cacheDir)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# benchApi - best time of each phase over repeat runs, peak memory and
+# type mapping stats of a run
+def benchApi(opts, repeat, loader, cacheDir=None):
+    best = None
+    for i in range(repeat):
+        clearTypeMapping()
+        times = runPipeline(opts, loader, cacheDir).times
+        if best == None:
+            best = times
+        else:
+            best = { p: min(best[p], times[p]) for p in phases }
+    typeMapping = typeMappingStats()
+    return { "loader": loader, "times": best, "peakMemory": peakMemory(opts, loader, cacheDir),
+             "typeMapping": typeMapping }
+
+def printResults(results):
+    apis = list(results)
+    print("{:28}".format("phase (ms)") + "".join("{:>10}".format(a) for a in apis))
+    for p in phases:
+        if not any(results[a]["times"][p] for a in apis):
+            # phase of another loader
+            continue
+        print("{:28}".format(p) + "".join(
+                "{:10.1f}".format(results[a]["times"][p] * 1000) for a in apis))
+    print("{:28}".format("peak memory (KiB)") + "".join(
+            "{:10d}".format(results[a]["peakMemory"] // 1024) for a in apis))
+    for k in [ "table", "hits", "misses" ]:
+        print("{:28}".format("type mapping " + k) + "".join(
+                "{:10d}".format(results[a]["typeMapping"][k]) for a in apis))
+
+# compareResults - print the phases that regressed compared to baseline
+#   tolerance - relative slowdown (or memory increase) that is accepted
+#   minTime - absolute slowdown (in seconds) under which a phase is
+#     considered as noise
+# Returns the number of regressions
+def compareResults(results, baseline, tolerance, minTime):
+    regressions = 0
+    for api, res in results.items():
+        if api not in baseline:
+            print("{}: not in baseline".format(api))
+            continue
+        base = baseline[api]
+        if base.get("loader") != res["loader"]:
+            print("{}: baseline made with the {} loader, not compared".format(api, base.get("loader")))
+            continue
+        for p in phases:
+            cur = res["times"][p]
+            ref = base["times"].get(p)
+            if not ref: continue
+            if cur > ref * (1 + tolerance) and cur - ref > minTime:
+                regressions += 1
+                print("{}: {} regressed: {:.1f} ms -> {:.1f} ms ({:+.0%})".format(
+                        api, p, ref * 1000, cur * 1000, cur / ref - 1))
+        cur = res["peakMemory"]
+        ref = base["peakMemory"]
+        if cur > ref * (1 + tolerance):
+            regressions += 1
+            print("{}: peak memory regressed: {} KiB -> {} KiB ({:+.0%})".format(
+                    api, ref // 1024, cur // 1024, cur / ref - 1))
+    return regressions
+
+if __name__ == "__main__":
+
+    import argparse
+    import json
+    import os
+    import tempfile
+    from gen_d_files import makeBuildList
+
+    parser = argparse.ArgumentParser(description='Benchmark of the OpenGL D bindings generator')
+    parser.add_argument('--repeat', dest='repeat', type=int, default=3,
+                        help="Number of timed runs per API, the best is kept [3]")
+    parser.add_argument('--api', dest='apis', nargs="*",
+                        help="APIs to benchmark [all]")
+    parser.add_argument('--loader', dest='loader', default='stream', choices=loaders,
+                        help="Load the registries with this loader of gldreg.loadRegistry, "
+                             "or from a registry cache filled beforehand (cache) [stream]")
+    parser.add_argument('--save', dest='save',
+                        help="Save the results as baseline in this JSON file")
+    parser.add_argument('--compare', dest='compare',
+                        help="Compare the results with the baseline in this JSON file and "
+                             "exit with status 1 if a phase regressed")
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.2,
+                        help="Accepted relative regression [0.2]")
+    parser.add_argument('--min-time', dest='minTime', type=float, default=5,
+                        help="Regressions smaller than this (in ms) are ignored [5]")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as srcDir:
+        cacheDir = None
+        if args.loader == "cache":
+            cacheDir = os.path.join(srcDir, "cache")
+        for opts in makeBuildList("gld", srcDir, regDir, "glcore"):
+            if args.apis and opts.apiname not in args.apis:
+                continue
+            if cacheDir != None:
+                loadRegistry(opts.regFile, cacheDir)
+            results[opts.apiname] = benchApi(opts, args.repeat, args.loader, cacheDir)
+
+    printResults(results)
+
+    if args.save:
+        with open(args.save, mode="w") as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, mode="r") as file:
+            baseline = json.load(file)
+        regressions = compareResults(results, baseline, args.tolerance, args.minTime / 1000)
+        if regressions:
+            print("{} regression(s) compared to {}".format(regressions, args.compare))
+            sys.exit(1)
+        print("no regression compared to {}".format(args.compare))
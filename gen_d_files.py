@@ -11,66 +11,86 @@ def readExtsFile(path):
                 exts.append(ext)
     return exts
 
-if __name__ == "__main__":
-
-    import sys
-    import os
-    from os import path
-    import argparse
+# moduleFingerprint - hash of everything a generated module depends on:
+# the registry, the resolved generator options, the templates and the
+# sources of the generator itself.
+def moduleFingerprint(opts, templates):
+    import hashlib
+    import json
+    import reg, gldreg, gldgen, gldgraph
 
-    import xml.etree.ElementTree as etree
-
-    rootDir = path.dirname(path.realpath(__file__))
-    regDir = path.join(rootDir, 'registry')
-    sys.path.insert(0, regDir)
-
-    from reg import Registry
-    from gldgen import *
-
-    parser = argparse.ArgumentParser(description='OpenGL D bindings generator')
-    parser.add_argument('--package', dest='package', default='gld',
-                        help='D package of generated modules [gld]')
-    parser.add_argument('--dest', dest='dest', default=path.join(rootDir, 'd'),
-                        help='Destination folder for generated files [(gldgen)/d]')
-    parser.add_argument('--gl-def-exts', dest='glDefExts', 
-                        help='Set of default extensions to include in the generation')
-    parser.add_argument('--gl-addext-file', dest='glAddExtFile', 
-                        help="Path to file containing extensions to add (one by line)")
-    parser.add_argument('--gl-remext', dest='glRemExts', nargs="*", default=[],
-                        help="Extensions to remove (defaults to None)")
-    parser.add_argument('--gl-remext-file', dest='glRemExtFile', 
-                        help="Path to file containing extensions to remove (one by line)")
-    args = parser.parse_args()
+    def optValue(v):
+        # sortProcedure and such
+        return v.__module__ + '.' + v.__qualname__
 
-    pack = args.package
-    srcDir = path.join(args.dest, pack.replace('.', os.sep))
+    h = hashlib.sha256()
+    h.update(json.dumps(vars(opts), sort_keys=True, default=optValue).encode())
+    # this file defines the default options and reads the manifests
+    for f in [ opts.regFile, reg.__file__, gldreg.__file__, gldgen.__file__,
+               gldgraph.__file__, __file__ ] + templates:
+        with open(f, 'rb') as file:
+            h.update(file.read())
+    return h.hexdigest()
 
-    os.makedirs(srcDir, exist_ok=True)
+# genModules - generate the D modules described by a list of
+# DGeneratorOptions sharing the same registry file. The registry is loaded
+# once for all of them.
+# Module level so that it can be dispatched to a process pool.
+#   cacheDir - directory of the registry cache, or None to always parse
+#     the registry. Also holds the module fingerprints if opts.incremental
+#     is set. In that case, generation is skipped if the fingerprint of the
+#     module did not change since the last generation.
+#   templates - template files taken into account in the fingerprint
+#   loader - registry loader (see gldreg.registryLoaders)
+# Returns the names of the generated files. The fingerprint file holds
+# the fingerprint followed by these names, one per line.
+def genModules(optsList, cacheDir=None, templates=[], loader="stream"):
+    import hashlib
+    from os import path
+    from gldreg import loadRegistry
+    from gldgen import DGenerator, writeFile
 
     files = []
+    reg = None
+    for opts in optsList:
+        if opts.incremental:
+            fingerprint = moduleFingerprint(opts, templates)
+            fpFile = path.join(cacheDir, "{}-{}.fingerprint".format(
+                    opts.module, hashlib.sha256(opts.filename.encode()).hexdigest()[:16]))
+            try:
+                with open(fpFile, 'r') as file:
+                    lines = file.read().splitlines()
+                    if len(lines) > 1 and lines[0] == fingerprint and \
+                            all(path.isfile(f) for f in lines[1:]):
+                        files += lines[1:]
+                        continue
+            except FileNotFoundError:
+                pass
 
-    # first we generate files from the hand-written templates
-    templateFiles = [ 'eglplatform.d.in', 'khrplatform.d.in', 'loader.d.in', 'util.d.in' ]
-    for tf in templateFiles:
-        from string import Template
-        with open(path.join(rootDir, 'templates', tf), mode="r") as ifile:
-            t = Template(ifile.read())
-            ofname = path.join(srcDir, tf.replace('.in', ''))
-            with open(ofname, mode="w") as ofile:
-                ofile.write(t.substitute(pack=pack))
-            files.append(ofname)
+        if reg == None:
+            reg = loadRegistry( opts.regFile, cacheDir, loader )
+        gen = DGenerator(reg)
+        reg.setGenerator( gen )
+        reg.apiGen(opts)
 
-    glRemExts = args.glRemExts
-    if args.glRemExtFile:
-        glRemExts += readExtsFile(args.glRemExtFile)
+        if opts.incremental:
+            writeFile(fpFile, "\n".join([ fingerprint ] + gen.outputFiles) + "\n")
+        files += gen.outputFiles
+    return files
 
-    glAddExts = []
-    if args.glAddExtFile:
-        glAddExts += readExtsFile(args.glAddExtFile) 
+# Turn a list of strings into a regexp string matching exactly those strings
+def makeREstring(list):
+    return "^(" + "|".join(list) + ")$"
 
-    # Turn a list of strings into a regexp string matching exactly those strings
-    def makeREstring(list):
-        return "^(" + "|".join(list) + ")$"
+# makeBuildList - options of the API modules to generate
+#   pack - D package of the generated modules
+#   srcDir - folder of the generated modules
+#   regDir - folder of the registry XML files
+#   glDefExts - set of default extensions of the gl module
+#   glAddExts, glRemExts - extensions to add to and remove from the gl module
+def makeBuildList(pack, srcDir, regDir, glDefExts=None, glAddExts=[], glRemExts=[]):
+    from os import path
+    from gldgen import DGeneratorOptions
 
     # Descriptive names for various regexp patterns used to select
     # versions and extensions
@@ -97,7 +117,7 @@ if __name__ == "__main__":
             profile             = "core",
             versions            = allVersions,
             emitversions        = allVersions,
-            defaultExtensions   = args.glDefExts,
+            defaultExtensions   = glDefExts,
             addExtensions       = glAddExtsPat,
             removeExtensions    = glRemExtsPat,
             regFile             = path.join(regDir, "gl.xml"),
@@ -182,14 +202,267 @@ if __name__ == "__main__":
             ]
         ),
     ]
+    return buildList
+
+# readManifest - options of the variants described in a manifest file.
+# The manifest is a JSON object with a list of variants:
+#   {
+#       "variants": [
+#           {
+#               "api": "gl",
+#               "module": "glcompat",
+#               "profile": "compatibility",
+#               "defaultExtensions": "gl",
+#               "addExtensions": [ "GL_ARB_bindless_texture" ],
+#               "removeExtensionsFile": "remexts.txt",
+#               "options": { "lazyLoading": true }
+#           }
+#       ]
+#   }
+# Each variant starts from the options of its api in baseList, and
+# overrides them with:
+#   module - name of the module in the package (defaults to the api)
+#   profile, defaultExtensions - as in DGeneratorOptions
+#   addExtensions, removeExtensions - lists of extensions names
+#   addExtensionsFile, removeExtensionsFile - files of extensions names,
+#     relative to the manifest (see readExtsFile)
+#   options - other DGeneratorOptions attributes
+def readManifest(manifestFile, pack, srcDir, baseList):
+    import copy
+    import json
+    import os
+    from os import path
+
+    with open(manifestFile, 'r') as file:
+        manifest = json.load(file)
+
+    manifestDir = path.dirname(path.abspath(manifestFile))
+    bases = { opts.apiname: opts for opts in baseList }
+    variantKeys = [ 'api', 'module', 'profile', 'defaultExtensions',
+                    'addExtensions', 'addExtensionsFile',
+                    'removeExtensions', 'removeExtensionsFile', 'options' ]
+
+    def extsPattern(variant, key):
+        exts = list(variant.get(key, []))
+        if key+'File' in variant:
+            exts += readExtsFile(path.join(manifestDir, variant[key+'File']))
+        return makeREstring(exts) if len(exts) else None
+
+    buildList = []
+    filenames = set()
+    for i, variant in enumerate(manifest.get('variants', [])):
+        unknown = [ k for k in variant if k not in variantKeys ]
+        if len(unknown):
+            raise ValueError("variant {}: unknown keys: {}".format(i, ", ".join(unknown)))
+        api = variant.get('api')
+        if api not in bases:
+            raise ValueError("variant {}: unknown api: {}".format(i, api))
+
+        opts = copy.copy(bases[api])
+        name = variant.get('module', api)
+        opts.module = "{}.{}".format(pack, name)
+        opts.filename = path.join(srcDir, name.replace('.', os.sep) + ".d")
+        if opts.filename in filenames:
+            raise ValueError("variant {}: module {} is generated twice".format(i, opts.module))
+        filenames.add(opts.filename)
+
+        if 'profile' in variant:
+            opts.profile = variant['profile']
+        if 'defaultExtensions' in variant:
+            opts.defaultExtensions = variant['defaultExtensions']
+        if 'addExtensions' in variant or 'addExtensionsFile' in variant:
+            opts.addExtensions = extsPattern(variant, 'addExtensions')
+        if 'removeExtensions' in variant or 'removeExtensionsFile' in variant:
+            opts.removeExtensions = extsPattern(variant, 'removeExtensions')
+        for k, v in variant.get('options', {}).items():
+            if k not in vars(opts):
+                raise ValueError("variant {}: unknown option: {}".format(i, k))
+            setattr(opts, k, v)
+        buildList.append(opts)
+
+    return buildList
+
+if __name__ == "__main__":
+
+    import sys
+    import os
+    from os import path
+    import argparse
+
+    rootDir = path.dirname(path.realpath(__file__))
+    regDir = path.join(rootDir, 'registry')
+    sys.path.insert(0, regDir)
+
+    from gldgen import *
+    from gldreg import registryLoaders
+
+    parser = argparse.ArgumentParser(description='OpenGL D bindings generator')
+    parser.add_argument('--package', dest='package', default='gld',
+                        help='D package of generated modules [gld]')
+    parser.add_argument('--dest', dest='dest', default=path.join(rootDir, 'd'),
+                        help='Destination folder for generated files [(gldgen)/d]')
+    parser.add_argument('--gl-def-exts', dest='glDefExts', 
+                        help='Set of default extensions to include in the generation')
+    parser.add_argument('--gl-addext-file', dest='glAddExtFile', 
+                        help="Path to file containing extensions to add (one by line)")
+    parser.add_argument('--gl-remext', dest='glRemExts', nargs="*", default=[],
+                        help="Extensions to remove (defaults to None)")
+    parser.add_argument('--gl-remext-file', dest='glRemExtFile', 
+                        help="Path to file containing extensions to remove (one by line)")
+    parser.add_argument('--jobs', '-j', dest='jobs', type=int, default=1,
+                        help="Number of API modules to generate in parallel [1]")
+    parser.add_argument('--cache-dir', dest='cacheDir',
+                        help="Directory to cache the parsed registries [no cache]")
+    parser.add_argument('--manifest', dest='manifest',
+                        help="Generate the variants described in this JSON file instead of "
+                             "the default modules (see readManifest)")
+    parser.add_argument('--registry-loader', dest='registryLoader', default='stream',
+                        choices=registryLoaders,
+                        help="Keep the whole XML tree of the registries in memory (tree), "
+                             "turn it into compact records (compact), or stream the XML "
+                             "into compact records (stream) [stream]")
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help="Skip the modules whose inputs did not change since the last "
+                             "generation and only write files whose content changed. "
+                             "Requires --cache-dir")
+    parser.add_argument('--lazy-loading', dest='lazyLoading', action='store_true',
+                        help="Load the symbol of each command at its first call instead "
+                             "of in the loader constructor")
+    parser.add_argument('--ext-gated-loading', dest='extGatedLoading', action='store_true',
+                        help="Generate a loader constructor that only loads the commands "
+                             "of a version and of the extensions supported by the context")
+    parser.add_argument('--dispatch-checks', dest='dispatchChecks', default='assert',
+                        choices=dispatchChecksStyles,
+                        help="How commands are checked to be loaded before being called: "
+                             "assert, assert unless version gld_unchecked is defined, "
+                             "or no check [assert]")
+    parser.add_argument('--method-attributes', dest='methodAttributes', default='none',
+                        choices=methodAttributesStyles,
+                        help="Whether commands methods are nothrow @nogc and pragma(inline): "
+                             "no, yes, or yes with a unittest checking the attributes [none]")
+    parser.add_argument('--layout', dest='layout', default='single', choices=layoutStyles,
+                        help="Generate each API in a single module, or as a package with "
+                             "a module per version and per extension (feature) "
+                             "or per extension vendor (vendor) [single]")
+    parser.add_argument('--dispatch-table', dest='dispatchTable', action='store_true',
+                        help="Lay out the struct of the command pointers (e.g. GlDispatch) "
+                             "with the hot commands first, and give access to it from the "
+                             "loader class")
+    parser.add_argument('--hot-commands', dest='hotCommands', default=defaultHotCommands,
+                        help="Regex matching the version commands laid out first in the "
+                             "dispatch table [draw calls, binds, uniforms...]")
+    parser.add_argument('--clone-constructor', dest='cloneConstructor', action='store_true',
+                        help="Generate a loader class constructor copying the commands of "
+                             "the loader of another context of the same driver")
+    parser.add_argument('--per-context-commands', dest='perContextCommands',
+                        help="Regex matching the commands that depend on the context, "
+                             "loaded again by the clone constructor [none]")
+    parser.add_argument('--profiling', dest='profiling', action='store_true',
+                        help="Generate per command call counters and timing, collected "
+                             "when the version gld_profile is defined")
+    parser.add_argument('--tracing', dest='tracing', action='store_true',
+                        help="Generate the recording of the calls when the version gld_trace "
+                             "is defined, and the metadata used by gldtrace.py to decode them")
+    parser.add_argument('--streaming-emission', dest='streamingEmission', action='store_true',
+                        help="Issue the sections of each feature to temporary files as "
+                             "it is generated and assemble the modules at the end. "
+                             "Only with the single layout")
+    parser.add_argument('--state-filter', dest='stateFilter', action='store_true',
+                        help="Generate a class wrapping the loader class (e.g. GlStateFilter) "
+                             "that drops redundant binds, enables... and answers their queries")
+    parser.add_argument('--command-encoder', dest='commandEncoder', action='store_true',
+                        help="Generate a struct recording commands in a buffer (e.g. "
+                             "GlCommandEncoder) and a function replaying it against the loader class")
+    args = parser.parse_args()
+    if args.incremental and not args.cacheDir:
+        parser.error("--incremental requires --cache-dir")
+    if args.perContextCommands and not args.cloneConstructor:
+        parser.error("--per-context-commands requires --clone-constructor")
+    if args.streamingEmission and args.layout != "single":
+        parser.error("--streaming-emission requires --layout single")
+    if args.extGatedLoading and args.lazyLoading:
+        parser.error("--ext-gated-loading cannot be combined with --lazy-loading")
+
+    pack = args.package
+    srcDir = path.join(args.dest, pack.replace('.', os.sep))
+
+    glRemExts = args.glRemExts
+    if args.glRemExtFile:
+        glRemExts += readExtsFile(args.glRemExtFile)
+
+    glAddExts = []
+    if args.glAddExtFile:
+        glAddExts += readExtsFile(args.glAddExtFile) 
+
+    buildList = makeBuildList(pack, srcDir, regDir, args.glDefExts, glAddExts, glRemExts)
 
     for opts in buildList:
-        gen = DGenerator()
-        reg = Registry()
-        reg.loadElementTree( etree.parse( opts.regFile ))
-        reg.setGenerator( gen )
-        reg.apiGen(opts)
-        files.append(opts.filename)
+        opts.incremental = args.incremental
+        opts.lazyLoading = args.lazyLoading
+        opts.extGatedLoading = args.extGatedLoading
+        opts.dispatchChecks = args.dispatchChecks
+        opts.methodAttributes = args.methodAttributes
+        opts.layout = args.layout
+        opts.dispatchTable = args.dispatchTable
+        opts.hotCommands = args.hotCommands
+        opts.cloneConstructor = args.cloneConstructor
+        opts.perContextCommands = args.perContextCommands
+        opts.profiling = args.profiling
+        opts.tracing = args.tracing
+        opts.streamingEmission = args.streamingEmission
+        opts.stateFilter = args.stateFilter
+        opts.commandEncoder = args.commandEncoder
+
+    if args.manifest:
+        try:
+            buildList = readManifest(args.manifest, pack, srcDir, buildList)
+        except (OSError, ValueError) as ex:
+            parser.error("{}: {}".format(args.manifest, ex))
+
+    os.makedirs(srcDir, exist_ok=True)
+
+    files = []
+
+    # first we generate files from the hand-written templates
+    templateFiles = [ 'eglplatform.d.in', 'khrplatform.d.in', 'loader.d.in', 'util.d.in' ]
+    templatePaths = [ path.join(rootDir, 'templates', tf) for tf in templateFiles ]
+    for tf in templateFiles:
+        from string import Template
+        with open(path.join(rootDir, 'templates', tf), mode="r") as ifile:
+            t = Template(ifile.read())
+            ofname = path.join(srcDir, tf.replace('.in', ''))
+            writeFile(ofname, t.substitute(pack=pack), onlyIfChanged=args.incremental)
+            files.append(ofname)
+
+    # modules sharing a registry file are generated from a single load
+    groups = {}
+    for opts in buildList:
+        groups.setdefault(opts.regFile, []).append(opts)
+    groups = list(groups.values())
+
+    if args.jobs > 1:
+        # each group of modules is generated in its own process
+        # results are collected in build order to keep dmd_args.txt stable
+        from concurrent.futures import ProcessPoolExecutor
+        failed = []
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [ executor.submit(genModules, group, args.cacheDir, templatePaths,
+                                        args.registryLoader) for group in groups ]
+            for group, future in zip(groups, futures):
+                try:
+                    files += future.result()
+                except Exception as ex:
+                    modules = [ opts.module for opts in group ]
+                    failed += modules
+                    print("error: generation of {} failed: {}: {}".format(
+                            ", ".join(modules), type(ex).__name__, ex), file=sys.stderr)
+        if len(failed):
+            print("error: {} module(s) failed: {}".format(len(failed), ", ".join(failed)),
+                    file=sys.stderr)
+            sys.exit(1)
+    else:
+        for group in groups:
+            files += genModules(group, args.cacheDir, templatePaths, args.registryLoader)
 
     import platform
     libname=''
@@ -198,10 +471,10 @@ if __name__ == "__main__":
     else:
         libname='libgld.a'
 
-    with open(path.join(rootDir, 'dmd_args.txt'), "w") as argfile:
-        argfile.write('-lib\n')
-        argfile.write('-I'+args.dest+'\n')
-        argfile.write('-of'+path.join(rootDir, libname)+'\n')
-        for f in files:
-            if not 'glx' in f: # exclude due to external dep
-                argfile.write(f + '\n')
+    dmdArgs = '-lib\n'
+    dmdArgs += '-I'+args.dest+'\n'
+    dmdArgs += '-of'+path.join(rootDir, libname)+'\n'
+    for f in files:
+        if f.endswith('.d') and not 'glx' in f: # exclude due to external dep
+            dmdArgs += f + '\n'
+    writeFile(path.join(rootDir, 'dmd_args.txt'), dmdArgs, onlyIfChanged=args.incremental)
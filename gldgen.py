@@ -4,8 +4,16 @@
     Reads OpenGL XML API definition to produce the D bindings code.
 """
 
+import functools
+import json
+import os
 import re
+import shutil
+import tempfile
+from os import path
+import gldprof
 from reg import GeneratorOptions, OutputGenerator, regSortFeatures
+from gldreg import typeRecord, groupRecord, enumRecord, cmdRecord
 
 # General utility
 
@@ -18,6 +26,76 @@ def noneStr(str):
     else:
         return ""
 
+# writeFile - write content to a text file
+#   onlyIfChanged - leave the file untouched (including its modification
+#     time) if it already has this content
+#   atomic - write a temporary file and rename it, so that concurrent
+#     readers (e.g. a build) never see a partially written file
+# Returns whether the file was written.
+def writeFile(filename, content, onlyIfChanged=False, atomic=True):
+    return writeParts(filename, [ content ], onlyIfChanged, atomic)
+
+# writeParts - same as writeFile, with the content given as a list of
+# strings and of text files (such as SectionSpool.file), which are copied
+# from their start without being read in memory at once
+def writeParts(filename, parts, onlyIfChanged=False, atomic=True):
+    if onlyIfChanged and hasParts(filename, parts):
+        return False
+    if not atomic:
+        with open(filename, mode="w") as file:
+            copyParts(parts, file)
+        return True
+    tmpFile = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        with open(tmpFile, mode="w") as file:
+            copyParts(parts, file)
+        os.replace(tmpFile, filename)
+    except BaseException:
+        if path.exists(tmpFile):
+            os.remove(tmpFile)
+        raise
+    return True
+
+def copyParts(parts, file):
+    for p in parts:
+        if isinstance(p, str):
+            file.write(p)
+        else:
+            p.seek(0)
+            shutil.copyfileobj(p, file)
+
+# hasParts - whether the file exists and has the content of parts
+def hasParts(filename, parts):
+    try:
+        with open(filename, mode="r") as file:
+            for p in parts:
+                if isinstance(p, str):
+                    if file.read(len(p)) != p: return False
+                    continue
+                p.seek(0)
+                while True:
+                    chunk = p.read(65536)
+                    if not len(chunk): break
+                    if file.read(len(chunk)) != chunk: return False
+            return file.read(1) == ""
+    except FileNotFoundError:
+        return False
+
+# removeGenerated - remove a file, or recursively a folder, generated by
+# gldgen. Used to clean up the output of another layout. Files that were not
+# generated by gldgen are left in place.
+def removeGenerated(p):
+    if path.isdir(p):
+        for f in os.listdir(p):
+            removeGenerated(path.join(p, f))
+        if not len(os.listdir(p)):
+            os.rmdir(p)
+    elif path.isfile(p):
+        with open(p, mode="r") as file:
+            if not "Generated automatically by gldgen" in file.readline():
+                return
+        os.remove(p)
+
 # SourceFile: gather and format the source code in the different sections
 # and issue them into a file
 class SourceFile(object):
@@ -64,9 +142,32 @@ class SourceFile(object):
         self._lines.append(indent + (fmt % args))
 
 
+    def lineCount(self):
+        return len(self._lines)
+
+    def content(self):
+        '''
+        the whole file content, joined once
+        '''
+        return "".join([ line.rstrip() + "\n" for line in self._lines ])
+
     def writeOut(self, outFile):
-        for line in self._lines:
-            print(line.rstrip(), file=outFile)
+        outFile.write(self.content())
+
+# SectionSpool: temporary file receiving a section of a module feature by
+# feature, so that the items of a feature can be released once written
+class SectionSpool(object):
+    def __init__(self):
+        self.file = tempfile.TemporaryFile(mode="w+")
+        # number of features appended
+        self.count = 0
+
+    def append(self, sf):
+        self.file.write(sf.content())
+        self.count += 1
+
+    def close(self):
+        self.file.close()
 
 
 # D specific utilities
@@ -133,7 +234,7 @@ def convertDTypeConst( typ ):
             return "const({})*".format(match.group(1).strip())
     return typ
 
-def mapDType(t):
+def translateDType(t):
     return convertDTypeConst(
         t   .replace("unsigned char", "ubyte")
             .replace("unsigned short", "ushort")
@@ -143,6 +244,56 @@ def mapDType(t):
             .strip()
     )
 
+# D type mapping
+#
+# mapDType is called for every type, struct field, parameter and return
+# type, while the registries only use a few hundred distinct C types.
+# The translations of the C types common to all registries are precomputed
+# in knownDTypes, the others are memoized in a bounded cache.
+# typeMappingStats() tells how the translations were obtained.
+
+knownCTypes = [
+    "void", "void*", "const void*", "void**", "const void**",
+    "char", "char*", "const char*", "const char**",
+    "signed char", "unsigned char", "unsigned char*", "const unsigned char*",
+    "short", "unsigned short", "int", "int*", "const int*",
+    "unsigned int", "unsigned int*", "const unsigned int*",
+    "long", "unsigned long", "unsigned long*",
+    "float", "float*", "const float*", "double", "double*", "const double*",
+    "int32_t", "int64_t", "uint64_t", "int64_t*", "uint64_t*",
+]
+knownDTypes = { t: translateDType(t) for t in knownCTypes }
+
+typeMappingCounts = { "table": 0 }
+
+@functools.lru_cache(maxsize=1024)
+def cachedDType(t):
+    return translateDType(t)
+
+def mapDType(t):
+    t = t.strip()
+    dt = knownDTypes.get(t)
+    if dt != None:
+        typeMappingCounts["table"] += 1
+        return dt
+    return cachedDType(t)
+
+# typeMappingStats - number of types mapped with knownDTypes (table), found
+# in the cache (hits) or translated (misses), and size of the cache
+def typeMappingStats():
+    info = cachedDType.cache_info()
+    return {
+        "table": typeMappingCounts["table"],
+        "hits": info.hits,
+        "misses": info.misses,
+        "cached": info.currsize,
+        "maxsize": info.maxsize,
+    }
+
+def clearTypeMapping():
+    typeMappingCounts["table"] = 0
+    cachedDType.cache_clear()
+
 def mapDName(name):
     if name in [ "ref" ]:
         return name + "_"
@@ -177,6 +328,12 @@ class DGenerator(OutputGenerator):
             self.funcptrs = []
             self.consts = []
             self.cmds = []
+            # (command, alias name) of commands of earlier features
+            # aliased by this feature
+            self.aliasedCmds = []
+            # (command, alias name) of the aliased commands declared by an
+            # extension, issued as aliases of their pointer type and method
+            self.cmdAliases = []
 
         def beginGuard(self, sf):
             if self.guard != None:
@@ -197,9 +354,12 @@ class DGenerator(OutputGenerator):
             self.value = value
 
     class Param:
-        def __init__(self, name, type):
+        def __init__(self, name, type, len=None, group=None):
             self.name = name
             self.type = type
+            # 'len' and 'group' attributes of command parameters
+            self.len = len
+            self.group = group
 
     class Struct:
         def __init__(self, name, params):
@@ -213,13 +373,19 @@ class DGenerator(OutputGenerator):
             self.params = params
 
     class Command:
-        def __init__(self, name, type, params, typedef, field):
+        def __init__(self, name, type, params, typedef, field, feature):
             self.name = name
             self.type = type
             self.params = params
             self.typedef = typedef
             self.field = field
+            # feature declaring the command
+            self.feature = feature
             self.aliases = []
+            # fields of the aliases issued as aliases of the method
+            self.aliasFields = []
+            # index in the command tables (see assignCommandIds)
+            self.id = None
 
     class Extension:
         def __init__(self, name, cmds):
@@ -233,8 +399,29 @@ class DGenerator(OutputGenerator):
             self.parentClsName = parentClsName
             self.cmds = cmds
 
-    def __init__(self):
+    # Section - part of the module gathering one kind of items of the features
+    #   items - attribute of Feature holding the items
+    #   head - lines issued before the first feature
+    #   body - issues the items of a feature
+    #   block - the features are issued in an indented extern(C) block,
+    #     separated by an empty line
+    class Section:
+        def __init__(self, items, head, body, block=False, more=[]):
+            self.items = items
+            self.head = head
+            self.body = body
+            self.block = block
+            # other items of the features issued by body
+            self.more = more
+
+        def hasItems(self, f):
+            return any(len(getattr(f, items)) for items in [ self.items ] + self.more)
+
+    #   registry - registry driving the generator, needed by the options
+    #     reading more than the generated features (stateFilter)
+    def __init__(self, registry=None):
         super().__init__()
+        self.registry = registry
         self.features = []
         self.feature = None
         self.featureGuards = {}
@@ -245,7 +432,27 @@ class DGenerator(OutputGenerator):
         self.handleDecls = []
         self.extensions = []
         self.cores = []
+        # name -> Command of all the commands issued so far, including the
+        # aliases folded into them
+        self.cmdIndex = {}
         self.lastLoaderClsName = ""
+        # items -> Section, in the order of the module
+        self.sections = {}
+        for s in [
+            DGenerator.Section("aliases", [ "", "// Base Types" ], self.issueFeatureTypes),
+            DGenerator.Section("structs", [ "", "// Struct definitions" ], self.issueFeatureStructs),
+            DGenerator.Section("funcptrs", [ "", "// Function pointers", "", "extern(C) nothrow @nogc {", "" ],
+                    self.issueFeatureFuncptrs, block=True),
+            DGenerator.Section("consts", [ "" ], self.issueFeatureConsts),
+            DGenerator.Section("cmds", [ "", "// Command pointer aliases", "", "extern(C) nothrow @nogc {", "" ],
+                    self.issueFeatureCmdPtrAliases, block=True, more=[ "cmdAliases" ]),
+        ]:
+            self.sections[s.items] = s
+        # items -> SectionSpool if opts.streamingEmission
+        self.spools = {}
+        # enum name -> integer value of the enums issued so far,
+        # if opts.stateFilter
+        self.enumValues = {}
 
     def addStructDecl(self, decl):
         if self.opts and decl in self.opts.importedStructDecls: return
@@ -271,32 +478,236 @@ class DGenerator(OutputGenerator):
         self.loaderClass = self.base
         self.baseCls = self.base + "Cmds"
         self.versionEnum = self.base + "Version"
+        self.extensionEnum = self.base + "Extension"
+        self.dispatchStruct = self.base + "Dispatch"
+        self.commandEnum = self.base + "Command"
+        self.commandNames = self.base.lower() + "CommandNames"
+        self.commandStats = self.base + "CommandStats"
+        self.stateFilterClass = self.base + "StateFilter"
+        self.commandEncoder = self.base + "CommandEncoder"
         self.versionField = self.base.lower() + "Version"
-        pass
+
+        if opts.dispatchChecks not in dispatchChecksStyles:
+            raise UserWarning("unknown dispatchChecks style: {}".format(opts.dispatchChecks))
+        if opts.methodAttributes not in methodAttributesStyles:
+            raise UserWarning("unknown methodAttributes style: {}".format(opts.methodAttributes))
+        if opts.layout not in layoutStyles:
+            raise UserWarning("unknown layout: {}".format(opts.layout))
+        if opts.methodAttributes != "none" and opts.lazyLoading:
+            raise UserWarning("methods cannot be nothrow @nogc with lazyLoading: "
+                              "they call the SymbolLoader, which is neither")
+        if opts.extGatedLoading and opts.lazyLoading:
+            raise UserWarning("extGatedLoading cannot gate the commands that "
+                              "lazyLoading resolves at their first call")
+        for name in [ "hotCommands", "perContextCommands" ]:
+            if getattr(opts, name):
+                try:
+                    re.compile(getattr(opts, name))
+                except re.error as e:
+                    raise UserWarning("invalid {} regex: {}".format(name, e))
+        if opts.streamingEmission and opts.layout != "single":
+            raise UserWarning("streamingEmission is only supported with the single layout")
+        if opts.stateFilter and self.registry == None:
+            raise UserWarning("stateFilter needs the registry (enum groups) given to DGenerator")
+
+        if opts.streamingEmission:
+            self.spools = { items: SectionSpool() for items in self.sections }
 
     def endFile(self):
+        # files written, in order
+        self.outputFiles = []
+        with gldprof.phase("endFile", api=self.apiname):
+            self.issueModules()
+            if self.opts.tracing:
+                self.writeTraceMetadata()
+
+    def issueModules(self):
+        splitDir = path.splitext(self.opts.filename)[0]
+
+        if self.opts.layout != "single":
+            self.issueSplitModules(splitDir)
+            removeGenerated(self.opts.filename)
+            return
+
+        if self.opts.streamingEmission:
+            try:
+                self.issueStreamedModule()
+            finally:
+                for spool in self.spools.values():
+                    spool.close()
+                self.spools = {}
+            removeGenerated(splitDir)
+            return
+
+        sf = self.beginModule(self.opts.module)
+        self.issue(self.issueTypes, sf)
+        self.issue(self.issueStructDecls, sf)
+        self.issue(self.issueStructDefs, sf)
+        self.issue(self.issueFuncptrs, sf)
+        self.issue(self.issueConsts, sf)
+        self.issue(self.issueCmdPtrAliases, sf)
+        self.issueLoaderDefs(sf)
+        self.writeModule(sf, self.opts.filename)
+        removeGenerated(splitDir)
+
+    # beginModule - start a module with the header and the statements
+    #   part - description of the part of the API held by the module
+    #     if the output is split in several modules
+    def beginModule(self, module, part=None):
         sf = SourceFile()
-        sf("/// %s bindings for D. Generated automatically by gldgen.", self.opts.humanName)
+        if part == None:
+            sf("/// %s bindings for D. Generated automatically by gldgen.", self.opts.humanName)
+        else:
+            sf("/// %s bindings for D: %s. Generated automatically by gldgen.",
+                    self.opts.humanName, part)
         sf("/// See https://github.com/rtbo/gldgen")
-        sf("module %s;", self.opts.module)
+        sf("module %s;", module)
         sf()
         for stmt in self.opts.stmts:
             sf(stmt)
-
-        self.issueTypes(sf)
-        self.issueStructDecls(sf)
-        self.issueStructDefs(sf)
-        self.issueFuncptrs(sf)
-        self.issueConsts(sf)
-        self.issueCmdPtrAliases(sf)
-        self.issueVersionEnum(sf)
+        return sf
+
+    def writeModule(self, sf, filename):
+        self.writeModuleParts([ sf.content() ], filename, lines=sf.lineCount())
+
+    # writeModuleParts - write a module given as parts (see writeParts)
+    #   counts - counts reported to gldprof
+    def writeModuleParts(self, parts, filename, **counts):
+        with gldprof.phase("writeModule", api=self.apiname, file=filename, **counts):
+            writeParts(filename, parts, onlyIfChanged=self.opts.incremental)
+        self.outputFiles.append(filename)
+
+    # issue - call an issue* emitter, reporting it to gldprof with the
+    # number of lines it emitted
+    def issue(self, emitter, sf, *args):
+        with gldprof.phase(emitter.__name__, api=self.apiname) as ph:
+            lines = sf.lineCount()
+            emitter(sf, *args)
+            ph.count("lines", sf.lineCount() - lines)
+
+    # version and extension enums, loader class
+    def issueLoaderDefs(self, sf):
+        self.assignCommandIds()
+        self.issue(self.issueVersionEnum, sf)
+        if self.opts.extGatedLoading:
+            self.issue(self.issueExtensionEnum, sf)
         # self.issueExtensionsLoader(sf)
         # self.issueCoreLoaders(sf)
         # self.issueLoaderFunc(sf)
-        self.issueLoader(sf)
+        self.issue(self.issueLoader, sf)
+        self.issue(self.issueCommandTable, sf)
+        self.issue(self.issueDispatchTable, sf)
+        if self.opts.profiling:
+            self.issue(self.issueProfiling, sf)
+        if self.opts.tracing:
+            self.issue(self.issueTracing, sf)
+        if self.opts.stateFilter:
+            self.issue(self.issueStateFilter, sf)
+        if self.opts.commandEncoder:
+            self.issue(self.issueCommandEncoder, sf)
+        if self.opts.methodAttributes == "check":
+            self.issue(self.issueAttributesCheck, sf)
+
+    # issueStreamedModule - issue the single module from the sections
+    # spooled by spoolFeature. Only the struct declarations and the loader
+    # are issued here.
+    def issueStreamedModule(self):
+        sf = self.beginModule(self.opts.module)
+        parts = [ sf.content() ] + self.spooledSection("aliases")
+        sf = SourceFile()
+        self.issue(self.issueStructDecls, sf)
+        parts.append(sf.content())
+        for items in [ "structs", "funcptrs", "consts", "cmds" ]:
+            parts += self.spooledSection(items)
+        sf = SourceFile()
+        self.issueLoaderDefs(sf)
+        parts.append(sf.content())
+        self.writeModuleParts(parts, self.opts.filename)
 
-        with open(self.opts.filename, "w") as outFile:
-            sf.writeOut(outFile)
+    # spooledSection - parts of a spooled section, with its head and end
+    def spooledSection(self, items):
+        section = self.sections[items]
+        spool = self.spools[items]
+        if not spool.count: return []
+
+        sf = SourceFile()
+        for line in section.head:
+            sf(line)
+        parts = [ sf.content(), spool.file ]
+        if section.block:
+            parts.append("}\n")
+        return parts
+
+    # splitModuleName - name of the split module declaring the constants
+    # and command pointers of a feature
+    def splitModuleName(self, feature):
+        if self.opts.layout == "vendor" and not feature.name.startswith(self.versionTag):
+            # GL_ARB_xxx => gl_arb
+            return "_".join(feature.name.split("_", 2)[:2]).lower()
+        return feature.name.lower()
+
+    # issueSplitModules - issue the API in the splitDir folder:
+    #   types.d - types, structs and function pointers of all features
+    #   one module per feature (or per vendor) with its constants and
+    #     command pointer aliases
+    #   cmds.d - version enum and loader class
+    #   package.d - public import of all the above
+    # Client code that only needs constants and types of a few features can
+    # import their modules and avoid compiling the whole API. The loader class
+    # is not split: cmds.d holds all the command pointers and methods, and
+    # imports all the feature modules.
+    def issueSplitModules(self, splitDir):
+        os.makedirs(splitDir, exist_ok=True)
+        mod = self.opts.module
+
+        groups = {}
+        for f in self.features:
+            if len(f.consts) or len(f.cmds) or len(f.cmdAliases):
+                groups.setdefault(self.splitModuleName(f), []).append(f)
+
+        sf = self.beginModule(mod + ".types", "types")
+        self.issue(self.issueTypes, sf)
+        self.issue(self.issueStructDecls, sf)
+        self.issue(self.issueStructDefs, sf)
+        self.issue(self.issueFuncptrs, sf)
+        self.writeModule(sf, path.join(splitDir, "types.d"))
+
+        for name, feats in groups.items():
+            part = feats[0].name
+            if name != part.lower():
+                part = name.upper() + " extensions"
+            sf = self.beginModule(mod + "." + name, part)
+            sf()
+            sf("import %s.types;", mod)
+            # modules of the commands aliased by these features
+            for target in sorted(set(self.splitModuleName(cmd.feature) for f in feats
+                                        for cmd, _ in f.cmdAliases) - { name }):
+                sf("import %s.%s;", mod, target)
+            self.issue(self.issueConsts, sf, feats)
+            self.issue(self.issueCmdPtrAliases, sf, feats)
+            self.writeModule(sf, path.join(splitDir, name + ".d"))
+
+        sf = self.beginModule(mod + ".cmds", "loader")
+        sf()
+        sf("import %s.types;", mod)
+        for name in groups:
+            sf("import %s.%s;", mod, name)
+        self.issueLoaderDefs(sf)
+        self.writeModule(sf, path.join(splitDir, "cmds.d"))
+
+        sf = self.beginModule(mod)
+        sf()
+        sf("public import %s.types;", mod)
+        for name in groups:
+            sf("public import %s.%s;", mod, name)
+        sf("public import %s.cmds;", mod)
+        self.writeModule(sf, path.join(splitDir, "package.d"))
+
+        # modules of features no longer generated or of another grouping
+        for f in os.listdir(splitDir):
+            p = path.join(splitDir, f)
+            if p not in self.outputFiles:
+                removeGenerated(p)
 
 
     def beginFeature(self, interface, emit):
@@ -332,26 +743,44 @@ class DGenerator(OutputGenerator):
                     DGenerator.Extension(self.feature.name, self.feature.cmds)
                 )
         self.features.append(self.feature)
+        if len(self.spools):
+            self.spoolFeature(self.feature)
         self.feature = None
 
+    # spoolFeature - with opts.streamingEmission, append the sections of a
+    # completed feature to their spools and release its items, so that only
+    # one feature is held in memory at once. The commands are kept for the
+    # loader, which is issued last as later features may still fold
+    # aliases into them.
+    def spoolFeature(self, f):
+        with gldprof.phase("spoolFeature", api=self.apiname, feature=f.name) as ph:
+            for items, spool in self.spools.items():
+                section = self.sections[items]
+                if not section.hasItems(f): continue
+                sf = SourceFile()
+                if section.block:
+                    sf.indent()
+                    if spool.count: sf()
+                section.body(sf, f)
+                spool.append(sf)
+                ph.count("lines", sf.lineCount())
+        f.aliases = []
+        f.structs = []
+        f.funcptrs = []
+        f.consts = []
+
     def genType(self, typeinfo, name):
         super().genType(typeinfo, name)
 
-        nameEl = typeinfo.elem.find("name")
-        if nameEl == None or len(nameEl.text) == 0:
+        decl = typeRecord(typeinfo).decl
+        if decl == None:
             # filter preprocessing declarations
             return
 
-        self.parseType(typeinfo, name)
+        self.parseType(decl, name)
 
 
-    def parseType(self, typeinfo, name):
-        typeElem = typeinfo.elem
-        s = noneStr(typeElem.text)
-        for elem in typeElem:
-            s += noneStr(elem.text)
-            s += noneStr(elem.tail)
-
+    def parseType(self, s, name):
         match = re.match(reDeclHandle, s)
         if match:
             assert name == match.group(1)
@@ -431,8 +860,7 @@ class DGenerator(OutputGenerator):
 
     def genEnum(self, enuminfo, name):
         super().genEnum(enuminfo, name)
-        value = enuminfo.elem.get("value")
-        alias = noneStr(enuminfo.elem.get("alias"))
+        value = enumRecord(enuminfo).value
         if "EGL_CAST" in value:
             value = value                               \
                     .replace("EGL_CAST", "EGL_CAST!")   \
@@ -445,6 +873,12 @@ class DGenerator(OutputGenerator):
                     .replace("(", "")                   \
                     .replace(")", "")
 
+        if self.opts.stateFilter:
+            try:
+                self.enumValues[name] = int(value, 0)
+            except ValueError:
+                pass
+
         self.feature.consts.append(
                 DGenerator.Const(
                     name,
@@ -459,43 +893,41 @@ class DGenerator(OutputGenerator):
         if not name.startswith(self.opts.cmdPrefix):
             return
 
-        alias = cmdinfo.elem.find("alias")
-        if alias != None:
-            alias = alias.get("name")
-            for core in self.cores:
-                for cmd in core.cmds:
-                    if alias == cmd.name:
-                        cmd.aliases.append(name)
-                        return
-
-        proto = cmdinfo.elem.find("proto")
-        if proto == None: return
-
-        returnType = noneStr(proto.text)
-        for el in proto:
-            if el.tag != "name":
-                returnType += noneStr(el.text)
-            returnType += noneStr(el.tail)
-        returnType = mapDType(returnType.strip())
+        rec = cmdRecord(cmdinfo)
+
+        if rec.alias != None:
+            cmd = self.cmdIndex.get(rec.alias)
+            if cmd != None:
+                cmd.aliases.append(name)
+                self.feature.aliasedCmds.append((cmd, name))
+                self.cmdIndex[name] = cmd
+                if not cmd.feature.name.startswith(self.versionTag):
+                    # an extension command folded into the one of another
+                    # extension keeps its name
+                    cmd.aliasFields.append(name[len(self.opts.cmdPrefix):])
+                    self.feature.cmdAliases.append((cmd, name))
+                return
+
+        if rec.proto == None: return
+
+        returnType = mapDType(rec.proto.strip())
         if not len(returnType): return
 
         params = []
-        for pel in cmdinfo.elem.findall(".//param"):
-            n = mapDName(pel.find("name").text)
+        for p in rec.params:
+            n = mapDName(p.name)
             assert len(n)
-            t = noneStr(pel.text)
-            for el in pel:
-                if el.tag != "name": t += noneStr(el.text)
-                t += noneStr(el.tail)
-            t = t.replace(" *", "*")
+            t = p.decl.replace(" *", "*")
             if t.count("const") > 1: t = t.replace("*const*", "**")
             if t.startswith("struct "): t = t[len("struct "):]
             t = t.replace(" struct ", " ")
             t = mapDType(t)
-            params.append(DGenerator.Param(n, t.strip()))
+            params.append(DGenerator.Param(n, t.strip(), p.len, p.group))
 
         field = name[len(self.opts.cmdPrefix):]
-        self.feature.cmds.append(DGenerator.Command(name, returnType, params, "PFN_"+name, field))
+        cmd = DGenerator.Command(name, returnType, params, "PFN_"+name, field, self.feature)
+        self.cmdIndex[name] = cmd
+        self.feature.cmds.append(cmd)
 
 
 
@@ -511,151 +943,243 @@ class DGenerator(OutputGenerator):
             for h in self.handleDecls:
                 sf("alias %s = void*;", h)
 
-    def issueStructDefs(self, sf):
-        feats = [f for f in self.features if len(f.structs) > 0]
+    # issueSection - issue a section for the features having items in it
+    def issueSection(self, sf, section, features=None):
+        if features == None: features = self.features
+        feats = [f for f in features if section.hasItems(f)]
         if not len(feats): return
 
+        for line in section.head:
+            sf(line)
+        if section.block: sf.indent()
+        for i, f in enumerate(feats):
+            if section.block and i != 0: sf()
+            section.body(sf, f)
+        if section.block:
+            sf.unindent()
+            sf("}")
+
+    def issueStructDefs(self, sf):
+        self.issueSection(sf, self.sections["structs"])
+
+    def issueTypes(self, sf):
+        self.issueSection(sf, self.sections["aliases"])
+
+    def issueFuncptrs(self, sf):
+        self.issueSection(sf, self.sections["funcptrs"])
+
+    def issueConsts(self, sf, features=None):
+        self.issueSection(sf, self.sections["consts"], features)
+
+    def issueCmdPtrAliases(self, sf, features=None):
+        self.issueSection(sf, self.sections["cmds"], features)
+
+    def issueFeatureStructs(self, sf, f):
+        sf("// Structs for %s", f.name)
+        f.beginGuard(sf)
+        for s in f.structs:
+            maxLen = 0
+            for p in s.params:
+                maxLen = max(maxLen, len(p.type))
+            sf("struct %s {", s.name)
+            with sf.indentBlock():
+                for p in s.params:
+                    spacer = " " * (maxLen - len(p.type))
+                    sf("%s %s;", p.type, p.name)
+            sf("}")
+        f.endGuard(sf)
+
+    def issueFeatureTypes(self, sf, f):
         sf()
-        sf("// Struct definitions")
-        for f in feats:
-            sf("// Structs for %s", f.name)
-            f.beginGuard(sf)
-            for s in f.structs:
+        sf("// Types for %s", f.name)
+        f.beginGuard(sf)
+        maxLen = 0
+        for a in f.aliases:
+            maxLen = max(maxLen, len(a.name))
+        for a in f.aliases:
+            spacer = " " * (maxLen - len(a.name))
+            sf("alias %s%s = %s;", a.name, spacer, a.type)
+        f.endGuard(sf)
+
+    def issueFeatureFuncptrs(self, sf, f):
+        sf("// for %s", f.name)
+        f.beginGuard(sf)
+        for fp in f.funcptrs:
+            if not len(fp.params):
+                sf("alias %s = %s function();", fp.name, fp.type)
+            else:
                 maxLen = 0
-                for p in s.params:
+                for p in fp.params:
                     maxLen = max(maxLen, len(p.type))
-                sf("struct %s {", s.name)
+                sf("alias %s = %s function(", fp.name, fp.type)
                 with sf.indentBlock():
-                    for p in s.params:
+                    for i, p in enumerate(fp.params):
                         spacer = " " * (maxLen - len(p.type))
-                        sf("%s %s;", p.type, p.name)
-                sf("}")
-            f.endGuard(sf)
-
-    def issueTypes(self, sf):
-        feats = [f for f in self.features if len(f.aliases) > 0]
-        if not len(feats): return
+                        endLine = "" if i == len(fp.params)-1 else ","
+                        sf("%s%s %s%s", p.type, spacer, p.name, endLine)
+                sf(");")
+        f.endGuard(sf)
 
+    def issueFeatureConsts(self, sf, f):
         sf()
-        sf("// Base Types")
-        for f in feats:
-            sf()
-            sf("// Types for %s", f.name)
-            f.beginGuard(sf)
+        sf("// Constants for %s", f.name)
+        f.beginGuard(sf)
+        maxLen = 0
+        for c in f.consts:
+            maxLen = max(maxLen, len(c.name))
+        for c in f.consts:
+            spacer = " " * (maxLen - len(c.name))
+            sf("enum %s%s = %s;", c.name, spacer, c.value)
+        f.endGuard(sf)
+
+    def issueFeatureCmdPtrAliases(self, sf, f):
+        sf("// Command pointers for %s", f.name)
+        f.beginGuard(sf)
+        for cmd in f.cmds:
             maxLen = 0
-            for a in f.aliases:
-                maxLen = max(maxLen, len(a.name))
-            for a in f.aliases:
-                spacer = " " * (maxLen - len(a.name))
-                sf("alias %s%s = %s;", a.name, spacer, a.type)
-            f.endGuard(sf)
+            for p in cmd.params:
+                maxLen = max(maxLen, len(p.type))
+            fstLine = "alias {} = {} function (".format(cmd.typedef, cmd.type)
+            if len(cmd.params) == 0:
+                sf(fstLine+");")
+                continue
+
+            sf(fstLine)
+            with sf.indentBlock():
+                for p in cmd.params:
+                    spacer = " " * (maxLen-len(p.type))
+                    sf("%s%s %s,", p.type, spacer, p.name)
+            sf(");")
+        for cmd, name in f.cmdAliases:
+            sf("alias PFN_%s = %s;", name, cmd.typedef)
 
+        f.endGuard(sf)
 
-    def issueFuncptrs(self, sf):
-        feats = [f for f in self.features if len(f.funcptrs) > 0]
-        if not len(feats): return
+
+    def issueVersionEnum(self, sf):
+        if not len(self.cores): return
 
         sf()
-        sf("// Function pointers")
-        sf()
-        sf("extern(C) nothrow @nogc {")
-        sf()
+        sf("/// %s describes the version of %s", self.versionEnum, self.opts.humanName)
+        sf("enum %s {", self.versionEnum)
         with sf.indentBlock():
-            for i, f in enumerate(feats):
-                if i != 0: sf()
-                sf("// for %s", f.name)
-                f.beginGuard(sf)
-                for fp in f.funcptrs:
-                    if not len(fp.params):
-                        sf("alias %s = %s function();", fp.name, fp.type)
-                    else:
-                        maxLen = 0
-                        for p in fp.params:
-                            maxLen = max(maxLen, len(p.type))
-                        sf("alias %s = %s function(", fp.name, fp.type)
-                        with sf.indentBlock():
-                            for i, p in enumerate(fp.params):
-                                spacer = " " * (maxLen - len(p.type))
-                                endLine = "" if i == len(fp.params)-1 else ","
-                                sf("%s%s %s%s", p.type, spacer, p.name, endLine)
-                        sf(");")
-                f.endGuard(sf)
+            for core in self.cores:
+                num = core.clsName[-2:]
+                sf("%s = %s,", self.base.lower()+num, num)
         sf("}")
 
+    def extensionFeatures(self):
+        return [f for f in self.features if not f.name.startswith(self.versionTag)]
 
-    def issueConsts(self, sf):
-        feats = [f for f in self.features if len(f.consts) > 0]
-        if not len(feats): return
-
-        sf()
-        for f in feats:
-            sf()
-            sf("// Constants for %s", f.name)
-            f.beginGuard(sf)
-            maxLen = 0
-            for c in f.consts:
-                maxLen = max(maxLen, len(c.name))
-            for c in f.consts:
-                spacer = " " * (maxLen - len(c.name))
-                sf("enum %s%s = %s;", c.name, spacer, c.value)
-            f.endGuard(sf)
-
-    def issueCmdPtrAliases(self, sf):
-        feats = [f for f in self.features if len(f.cmds) > 0]
-        if not len(feats): return
+    def issueExtensionEnum(self, sf):
+        exts = self.extensionFeatures()
+        if not len(exts): return
 
         sf()
-        sf("// Command pointer aliases")
-        sf()
-        sf("extern(C) nothrow @nogc {")
-        sf()
+        sf("/// %s lists the %s extensions known to %s", self.extensionEnum,
+                self.opts.humanName, self.loaderClass)
+        sf("enum %s : uint {", self.extensionEnum)
         with sf.indentBlock():
-            for i, f in enumerate(feats):
-                if i != 0:
-                    sf()
-                sf("// Command pointers for %s", f.name)
-                f.beginGuard(sf)
-                for cmd in f.cmds:
-                    maxLen = 0
-                    for p in cmd.params:
-                        maxLen = max(maxLen, len(p.type))
-                    fstLine = "alias {} = {} function (".format(cmd.typedef, cmd.type)
-                    if len(cmd.params) == 0:
-                        sf(fstLine+");")
-                        continue
-
-                    sf(fstLine)
-                    with sf.indentBlock():
-                        for p in cmd.params:
-                            spacer = " " * (maxLen-len(p.type))
-                            sf("%s%s %s,", p.type, spacer, p.name)
-                    sf(");")
-
-                f.endGuard(sf)
-
+            for ext in exts:
+                sf("%s,", ext.name)
         sf("}")
 
-
-    def issueVersionEnum(self, sf):
-        if not len(self.cores): return
-
+    def issueGatedConstructor(self, sf):
+        exts = self.extensionFeatures()
         sf()
-        sf("/// %s describes the version of %s", self.versionEnum, self.opts.humanName)
-        sf("enum %s {", self.versionEnum)
+        sf("/// Load the commands of the %s versions up to ver and of the extensions", self.opts.humanName)
+        sf("/// listed in extensions (such as returned by util.splitExtString).")
+        sf("/// Commands of other extensions are not loaded.")
+        sf("/// The listed extensions known to %s are recorded (see hasExtension).", self.loaderClass)
+        sf("this(SymbolLoader loader, %s ver, in string[] extensions) {", self.versionEnum)
         with sf.indentBlock():
             for core in self.cores:
                 num = core.clsName[-2:]
-                sf("%s = %s,", self.base.lower()+num, num)
+                sf("if (ver >= %s.%s) {", self.versionEnum, self.base.lower()+num)
+                with sf.indentBlock():
+                    for cmd in core.cmds:
+                        sf(self.cmdLoadStmt(cmd, "loader"))
+                sf("}")
+            if len(exts):
+                sf("foreach (ext; extensions) {")
+                with sf.indentBlock():
+                    sf("switch (ext) {")
+                    for i, ext in enumerate(exts):
+                        sf("case \"%s\":", ext.name)
+                        with sf.indentBlock():
+                            for cmd in ext.cmds:
+                                sf(self.cmdLoadStmt(cmd, "loader"))
+                            # commands of other features also available through this extension under an alias
+                            for cmd, alias in ext.aliasedCmds:
+                                sf("if (%s is null) %s = cast(%s)loader(\"%s\");",
+                                        self.cmdPtr(cmd), self.cmdPtr(cmd), cmd.typedef, alias)
+                            sf("_loadedExts[%s] |= 1UL << %s;", i // 64, i % 64)
+                            sf("break;")
+                    sf("default:")
+                    with sf.indentBlock():
+                        sf("break;")
+                    sf("}")
+                sf("}")
         sf("}")
 
+        if len(exts):
+            sf()
+            sf("/// Whether ext was listed in the extensions passed to the extension gated constructor")
+            sf("public bool hasExtension(%s ext) const%s {", self.extensionEnum,
+                    "" if self.opts.methodAttributes == "none" else " nothrow @nogc")
+            with sf.indentBlock():
+                sf("return (_loadedExts[ext / 64] & (1UL << (ext %% 64))) != 0;")
+            sf("}")
+
+    # cmdPtr - expression of the command pointer of cmd in the loader class
+    def cmdPtr(self, cmd):
+        return "_dispatch." + cmd.field
+
+    def cmdLoadStmt(self, cmd, loader):
+        aliasStr = ", ".join(map((lambda a: "\""+a+"\""), cmd.aliases))
+        return "{} = cast({})loadSymbol({}, \"{}\", [{}]);".format(
+                self.cmdPtr(cmd), cmd.typedef, loader, cmd.name, aliasStr)
+
     def issueCmdMethodCall(self, sf, cmd):
         paramStr = ", ".join(map((lambda p: "{} {}".format(p.type, p.name)), cmd.params))
-        sf("public %s %s (%s) const {", cmd.type, cmd.field, paramStr)
+        # lazy loading methods resolve the symbol, hence cannot be const
+        qualifier = "" if self.opts.lazyLoading else " const"
+        if self.opts.methodAttributes != "none":
+            sf("pragma(inline, true)")
+            qualifier += " nothrow @nogc"
+        sf("public %s %s (%s)%s {", cmd.type, cmd.field, paramStr, qualifier)
         with sf.indentBlock():
-            sf("assert(_%s !is null, \"%s command %s was not loaded\");", cmd.field, self.opts.humanName, cmd.name)
+            if self.opts.lazyLoading:
+                sf("if (%s is null) %s", self.cmdPtr(cmd), self.cmdLoadStmt(cmd, "_loader"))
+            assertStmt = "assert({} !is null, \"{} command {} was not loaded\");".format(
+                    self.cmdPtr(cmd), self.opts.humanName, cmd.name)
+            if self.opts.dispatchChecks == "assert":
+                sf(assertStmt)
+            elif self.opts.dispatchChecks == "version":
+                sf("version(gld_unchecked) {} else %s", assertStmt)
+            if self.opts.tracing:
+                self.issueTraceRecord(sf, cmd)
             paramStr = ", ".join(map((lambda p: p.name), cmd.params))
-            sf("return _%s (%s);", cmd.field, paramStr)
+            if self.opts.profiling:
+                # no RAII nor scope(exit), that could prevent inlining
+                sf("version(gld_profile) {")
+                with sf.indentBlock():
+                    sf("const _start = %sProfileStart();", self.base.lower())
+                    if cmd.type == "void":
+                        sf("%s (%s);", self.cmdPtr(cmd), paramStr)
+                    else:
+                        sf("auto _ret = %s (%s);", self.cmdPtr(cmd), paramStr)
+                    sf("%sProfileEnd(%s.%s, _start);", self.base.lower(), self.commandEnum, cmd.field)
+                    if cmd.type != "void":
+                        sf("return _ret;")
+                sf("}")
+                sf("else return %s (%s);", self.cmdPtr(cmd), paramStr)
+            else:
+                sf("return %s (%s);", self.cmdPtr(cmd), paramStr)
         sf("}")
+        for field in cmd.aliasFields:
+            sf("/// ditto")
+            sf("public alias %s = %s;", field, cmd.field)
 
 
     def issueLoader(self, sf):
@@ -665,32 +1189,37 @@ class DGenerator(OutputGenerator):
         with sf.indentBlock():
             sf("this(SymbolLoader loader) {")
             with sf.indentBlock():
-                for core in self.cores:
-                    sf()
-                    sf("// %s", core.name)
-                    for cmd in core.cmds:
-                        aliasStr = ", ".join(map((lambda a: "\""+a+"\""), cmd.aliases))
-                        sf("_%s = cast(%s)loadSymbol(loader, \"%s\", [%s]);", cmd.field, cmd.typedef, cmd.name, aliasStr)
-                for ext in self.extensions:
-                    if not len(ext.cmds): break
-                    sf()
-                    sf("// %s,", ext.name)
-                    for cmd in ext.cmds:
-                        sf("_%s = cast(%s)loadSymbol(loader, \"%s\", []);", cmd.field, cmd.typedef, cmd.name)
+                if self.opts.lazyLoading:
+                    # symbols are loaded at first call of each command
+                    sf("_loader = loader;")
+                elif len(self.commands):
+                    sf("_dispatch.load(loader);")
             sf("}")
 
-            sf()
-            sf("private static void* loadSymbol(SymbolLoader loader, in string name, in string[] aliases) {")
-            with sf.indentBlock():
-                sf("void* sym = loader(name);")
-                sf("if (sym) return sym;")
-                sf("foreach (n; aliases) {")
+            if self.opts.extGatedLoading:
+                self.issueGatedConstructor(sf)
+
+            if self.opts.dispatchTable:
+                self.issueDispatchAccess(sf)
+
+            if self.opts.cloneConstructor:
+                self.issueCloneConstructor(sf)
+
+            # the commands loaded one by one (see cmdLoadStmt)
+            if self.opts.lazyLoading or self.opts.extGatedLoading or \
+                    (self.opts.cloneConstructor and len(self.cmdsMatching(self.opts.perContextCommands))):
+                sf()
+                sf("private static void* loadSymbol(SymbolLoader loader, in string name, in string[] aliases) {")
                 with sf.indentBlock():
-                    sf("sym = loader(n);")
+                    sf("void* sym = loader(name);")
                     sf("if (sym) return sym;")
+                    sf("foreach (n; aliases) {")
+                    with sf.indentBlock():
+                        sf("sym = loader(n);")
+                        sf("if (sym) return sym;")
+                    sf("}")
+                    sf("return null;")
                 sf("}")
-                sf("return null;")
-            sf("}")
 
 
             for core in self.cores:
@@ -711,17 +1240,874 @@ class DGenerator(OutputGenerator):
                         sf("/// ditto")
                     self.issueCmdMethodCall(sf, cmd)
 
-            for core in self.cores:
+            if self.opts.lazyLoading:
                 sf()
-                sf("// %s", core.name)
-                for cmd in core.cmds:
-                    sf("private %s _%s;", cmd.typedef, cmd.field)
-            for ext in self.extensions:
-                if not len(ext.cmds): break
+                sf("private SymbolLoader _loader;")
+            if self.opts.extGatedLoading and len(self.extensionFeatures()):
                 sf()
-                sf("// %s,", ext.name)
-                for cmd in ext.cmds:
-                    sf("private %s _%s;", cmd.typedef, cmd.field)
+                sf("private ulong[%s] _loadedExts;", (len(self.extensionFeatures()) + 63) // 64)
+            if len(self.commands):
+                sf()
+                sf("private %s _dispatch;", self.dispatchStruct)
+        sf("}")
+
+    # issueDispatchAccess - constructor of the loader class from a dispatch
+    # table and copy of its table
+    def issueDispatchAccess(self, sf):
+        sf()
+        sf("/// Build a %s from the commands of dispatch, e.g. loaded for another", self.loaderClass)
+        sf("/// context of the same driver. No symbol is looked up.")
+        if self.opts.lazyLoading:
+            sf("/// Commands that are null in dispatch are loaded with loader at their first call.")
+            sf("this(SymbolLoader loader, in %s dispatch) {", self.dispatchStruct)
+            with sf.indentBlock():
+                sf("_loader = loader;")
+                sf("_dispatch = cast(%s)dispatch;", self.dispatchStruct)
+        else:
+            sf("this(in %s dispatch) {", self.dispatchStruct)
+            with sf.indentBlock():
+                sf("_dispatch = cast(%s)dispatch;", self.dispatchStruct)
+        sf("}")
+
+        sf()
+        sf("/// Copy of the commands of this %s", self.loaderClass)
+        sf("public %s dispatch() const%s {", self.dispatchStruct,
+                "" if self.opts.methodAttributes == "none" else " nothrow @nogc")
+        with sf.indentBlock():
+            sf("return cast(%s)_dispatch;", self.dispatchStruct)
+        sf("}")
+
+    # issueCloneConstructor - constructor of the loader class for another
+    # context of the same driver, copying the commands of an existing loader
+    # and only loading again the commands matching opts.perContextCommands
+    def issueCloneConstructor(self, sf):
+        perContext = self.cmdsMatching(self.opts.perContextCommands)
+        withLoader = self.opts.lazyLoading or len(perContext)
+        sf()
+        sf("/// Build a %s for another context of the same driver as other, with the", self.loaderClass)
+        sf("/// commands loaded by other: no symbol is looked up.")
+        if len(perContext):
+            sf("/// The commands that depend on the context are loaded again with loader.")
+        if self.opts.extGatedLoading and len(self.extensionFeatures()):
+            sf("/// The extensions recorded by other are kept (see hasExtension).")
+        if withLoader:
+            sf("this(in %s other, SymbolLoader loader) {", self.loaderClass)
+        else:
+            sf("this(in %s other) {", self.loaderClass)
+        with sf.indentBlock():
+            sf("foreach (i, ref field; this.tupleof) {")
+            with sf.indentBlock():
+                sf("field = cast(typeof(field))other.tupleof[i];")
+            sf("}")
+            if self.opts.lazyLoading:
+                sf("_loader = loader;")
+            if len(perContext):
+                sf("// commands that depend on the context")
+                for cmd in perContext:
+                    sf(self.cmdLoadStmt(cmd, "loader"))
+        sf("}")
+
+    # cmdsMatching - commands of the versions and extensions whose name
+    # matches pattern (none if pattern is None)
+    def cmdsMatching(self, pattern):
+        if not pattern: return []
+        regex = re.compile(pattern)
+        return [ cmd for f in self.cores + self.extensions for cmd in f.cmds
+                    if regex.fullmatch(cmd.name) != None ]
+
+    # dispatchGroups - (title, commands) of the dispatch table, in order:
+    # the versions commands matching opts.hotCommands if opts.dispatchTable,
+    # then the other commands of each version and extension
+    def dispatchGroups(self):
+        hot = None
+        if self.opts.dispatchTable and self.opts.hotCommands:
+            hot = re.compile(self.opts.hotCommands)
+        isHot = lambda cmd: hot != None and hot.fullmatch(cmd.name) != None
+        groups = [ ("Hot commands", [ cmd for core in self.cores for cmd in core.cmds if isHot(cmd) ]) ]
+        for core in self.cores:
+            groups.append((core.name, [ cmd for cmd in core.cmds if not isHot(cmd) ]))
+        for ext in self.extensions:
+            groups.append((ext.name, ext.cmds))
+        return [ g for g in groups if len(g[1]) ]
+
+    # issueDispatchTable - plain struct of the command pointers in which the
+    # loader class stores them, with a bulk loader looping over the table of
+    # the command names instead of a statement per command. With
+    # opts.dispatchTable, the pointers are laid out so that the commands used
+    # every frame share a few cache lines. Copying the struct copies the
+    # whole table.
+    def issueDispatchTable(self, sf):
+        groups = self.dispatchGroups()
+        if not len(groups): return
+
+        sf()
+        if self.opts.dispatchTable:
+            sf("/// Command pointers of %s in a plain struct, frequently used commands first.", self.opts.humanName)
+        else:
+            sf("/// Command pointers of %s in a plain struct, indexed by %s.", self.opts.humanName, self.commandEnum)
+        sf("/// A loaded %s can be copied and shared by the contexts of a same driver.", self.dispatchStruct)
+        sf("struct %s {", self.dispatchStruct)
+        with sf.indentBlock():
+            for title, group in groups:
+                sf("// %s", title)
+                for cmd in group:
+                    sf("%s %s;", cmd.typedef, cmd.field)
+                sf()
+
+            sf("/// Load all commands with loader, trying the aliases of the commands not found.")
+            sf("/// Commands that cannot be loaded are set to null.")
+            sf("void load(SymbolLoader loader) {")
+            with sf.indentBlock():
+                sf("auto ptrs = cast(void**)&this;")
+                sf("foreach (i, names; %s) {", self.commandNames)
+                with sf.indentBlock():
+                    sf("ptrs[i] = null;")
+                    sf("foreach (n; names) {")
+                    with sf.indentBlock():
+                        sf("ptrs[i] = loader(n);")
+                        sf("if (ptrs[i]) break;")
+                    sf("}")
+                sf("}")
+            sf("}")
+        sf("}")
+        sf()
+        sf("static assert(%s.sizeof == %s.length * (void*).sizeof);",
+                self.dispatchStruct, self.commandNames)
+
+    # traceArg - how the argument of p is traced in a call of cmd, as a
+    # (kind, D expression) tuple. kind is:
+    #   'value' - the argument itself
+    #   'size' - the size in bytes of the array pointed to, if its 'len'
+    #     is a number or another parameter, possibly times a number
+    #   'pointer' - the address, for the other pointers
+    def traceArg(self, cmd, p):
+        if not p.type.endswith("*"):
+            return "value", "{}TraceWord({})".format(self.base.lower(), p.name)
+        size = self.arraySize(cmd, p)
+        if size != None:
+            return "size", size
+        return "pointer", "{}TraceWord({})".format(self.base.lower(), p.name)
+
+    # arraySize - D expression of the size in bytes of the array pointed to
+    # by p in a call of cmd, if its 'len' is a number or another parameter,
+    # possibly times a number. None otherwise.
+    def arraySize(self, cmd, p):
+        m = re.fullmatch(r"(\w+)(\*\d+)?", p.len) if p.len != None else None
+        if m == None: return None
+        count = None
+        if m.group(1).isdigit():
+            count = m.group(1)
+        else:
+            lenName = mapDName(m.group(1))
+            for lp in cmd.params:
+                if lp.name == lenName and not lp.type.endswith("*"):
+                    count = lenName
+        if count == None: return None
+        if m.group(2) != None:
+            count += m.group(2)
+        return "cast(ulong)({}) * typeof(*{}).sizeof".format(count, p.name)
+
+    # issueTraceRecord - record of a call in the trace (see issueTracing)
+    def issueTraceRecord(self, sf, cmd):
+        begin = "{}TraceBegin({}.{}, {})".format(self.base.lower(), self.commandEnum,
+                cmd.field, len(cmd.params))
+        if not len(cmd.params):
+            sf("version(gld_trace) %s;", begin)
+            return
+        sf("version(gld_trace) {")
+        with sf.indentBlock():
+            sf("if (auto _rec = %s) {", begin)
+            with sf.indentBlock():
+                for i, p in enumerate(cmd.params):
+                    sf("_rec[%s] = %s;", i, self.traceArg(cmd, p)[1])
+            sf("}")
+        sf("}")
+
+    # issueTracing - recording of the calls of the loader class methods in a
+    # buffer if the version gld_trace is defined. The records are decoded by
+    # gldtrace.py with the metadata written by writeTraceMetadata.
+    def issueTracing(self, sf):
+        if not len(self.commands): return
+        api = self.base.lower()
+
+        sf()
+        sf("version(gld_trace) {")
+        with sf.indentBlock():
+            sf("private ulong[] _%sTrace;", api)
+            sf("private size_t _%sTraceLen;", api)
+            sf("private ulong _%sTraceDropped;", api)
+            sf()
+            sf("/// Record the calls of this thread to the %s methods in buffer.", self.loaderClass)
+            sf("/// Each call is recorded as a header word (argument count << 32 | %s)", self.commandEnum)
+            sf("/// followed by a word per argument. Pointers are recorded as the size")
+            sf("/// of the array pointed to where the registry gives it.")
+            sf("void %sTraceStart(ulong[] buffer) nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("_%sTrace = buffer;", api)
+                sf("_%sTraceLen = 0;", api)
+                sf("_%sTraceDropped = 0;", api)
+            sf("}")
+            sf()
+            sf("/// Stop recording. Returns the records not taken yet.")
+            sf("const(ulong)[] %sTraceStop() nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("auto words = %sTraceTake();", api)
+                sf("_%sTrace = null;", api)
+                sf("return words;")
+            sf("}")
+            sf()
+            sf("/// Take the records of the calls since the last take, e.g. every frame to")
+            sf("/// append them to a file. The buffer is then filled again from its start,")
+            sf("/// so the returned words are only valid until the next recorded call.")
+            sf("const(ulong)[] %sTraceTake() nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("auto words = _%sTrace[0 .. _%sTraceLen];", api, api)
+                sf("_%sTraceLen = 0;", api)
+                sf("return words;")
+            sf("}")
+            sf()
+            sf("/// Record the end of a frame")
+            sf("void %sTraceFrame() nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("%sTraceBegin(uint.max, 0);", api)
+            sf("}")
+            sf()
+            sf("/// Number of calls not recorded because the buffer was full")
+            sf("ulong %sTraceDropped() nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("return _%sTraceDropped;", api)
+            sf("}")
+            sf()
+            sf("// record of a call of the command id, or null if the buffer is full")
+            sf("private ulong* %sTraceBegin(uint id, uint argc) nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("if (_%sTraceLen + argc + 1 > _%sTrace.length) {", api, api)
+                with sf.indentBlock():
+                    sf("if (_%sTrace.length) _%sTraceDropped++;", api, api)
+                    sf("return null;")
+                sf("}")
+                sf("auto rec = &_%sTrace[_%sTraceLen];", api, api)
+                sf("rec[0] = (cast(ulong)argc << 32) | id;")
+                sf("_%sTraceLen += argc + 1;", api)
+                sf("return rec + 1;")
+            sf("}")
+            sf()
+            sf("// argument as a record word: integers are extended, floating points")
+            sf("// keep their bits and pointers are recorded as addresses")
+            sf("private ulong %sTraceWord(T)(T v) nothrow @nogc {", api)
+            with sf.indentBlock():
+                sf("static if (is(immutable T == immutable float)) return *cast(uint*)&v;")
+                sf("else static if (is(immutable T == immutable double)) return *cast(ulong*)&v;")
+                sf("else static if (is(T : ulong)) return cast(ulong)v;")
+                sf("else return cast(ulong)cast(size_t)cast(const(void)*)v;")
+            sf("}")
+        sf("}")
+
+    # writeTraceMetadata - write next to the module the metadata needed by
+    # gldtrace.py to decode the traces: the commands indexed by id, with
+    # their parameters and how they are recorded
+    def writeTraceMetadata(self):
+        commands = []
+        for cmd in self.commands:
+            params = []
+            for p in cmd.params:
+                param = { "name": p.name, "type": p.type, "kind": self.traceArg(cmd, p)[0] }
+                if p.group != None: param["group"] = p.group
+                if p.len != None: param["len"] = p.len
+                params.append(param)
+            commands.append({ "name": cmd.name, "returns": cmd.type, "params": params })
+        meta = {
+            "api": self.apiname,
+            "module": self.opts.module,
+            "frameMarker": 0xffffffff,
+            "commands": commands,
+        }
+        filename = path.splitext(self.opts.filename)[0] + ".trace.json"
+        with gldprof.phase("writeTraceMetadata", api=self.apiname, file=filename):
+            writeFile(filename, json.dumps(meta, indent=1) + "\n",
+                      onlyIfChanged=self.opts.incremental)
+        self.outputFiles.append(filename)
+
+    # assignCommandIds - number the commands in the order of the dispatch
+    # table. The ids index the command tables of the module.
+    def assignCommandIds(self):
+        self.commands = [ cmd for title, group in self.dispatchGroups() for cmd in group ]
+        for i, cmd in enumerate(self.commands):
+            cmd.id = i
+
+    # issueCommandTable - enum of the command ids and table of the command
+    # names, indexed by command id
+    def issueCommandTable(self, sf):
+        if not len(self.commands): return
+
+        sf()
+        sf("/// Ids of the %s commands, indexing the command tables", self.opts.humanName)
+        sf("enum %s : uint {", self.commandEnum)
+        with sf.indentBlock():
+            for cmd in self.commands:
+                sf("%s,", cmd.field)
+        sf("}")
+
+        sf()
+        sf("/// Names of the %s commands indexed by %s, each followed by its aliases",
+                self.opts.humanName, self.commandEnum)
+        sf("immutable string[][%s] %s = [", len(self.commands), self.commandNames)
+        with sf.indentBlock():
+            for cmd in self.commands:
+                sf("[ %s ],", ", ".join("\"{}\"".format(n) for n in [ cmd.name ] + cmd.aliases))
+        sf("];")
+
+    # issueProfiling - call statistics of the commands, collected by the
+    # loader class methods if the version gld_profile is defined
+    def issueProfiling(self, sf):
+        if not len(self.commands): return
+        stats = self.base.lower() + "CommandStats"
+        count = len(self.commands)
+
+        sf()
+        sf("/// Call statistics of a %s command", self.opts.humanName)
+        sf("struct %s {", self.commandStats)
+        with sf.indentBlock():
+            sf("/// number of calls")
+            sf("ulong calls;")
+            sf("/// time spent in the command in MonoTime ticks, if the version")
+            sf("/// gld_profile_timing is defined")
+            sf("ulong ticks;")
+        sf("}")
+
+        sf()
+        sf("version(gld_profile) {")
+        with sf.indentBlock():
+            sf("import core.atomic : atomicExchange, atomicLoad, atomicOp, atomicStore;")
+            sf("import core.time : MonoTime;")
+            sf()
+            sf("private shared %s[%s] _%s;", self.commandStats, count, stats)
+            sf()
+            sf("/// Copy the call statistics of the commands, indexed by %s, to stats.", self.commandEnum)
+            sf("/// If reset is set, the statistics are reset at the same time, e.g. every frame.")
+            sf("void %s(ref %s[%s] stats, bool reset = false) nothrow @nogc {", stats, self.commandStats, count)
+            with sf.indentBlock():
+                sf("foreach (i, ref s; stats) {")
+                with sf.indentBlock():
+                    sf("if (reset) {")
+                    with sf.indentBlock():
+                        sf("s.calls = atomicExchange(&_%s[i].calls, 0UL);", stats)
+                        sf("s.ticks = atomicExchange(&_%s[i].ticks, 0UL);", stats)
+                    sf("}")
+                    sf("else {")
+                    with sf.indentBlock():
+                        sf("s.calls = atomicLoad(_%s[i].calls);", stats)
+                        sf("s.ticks = atomicLoad(_%s[i].ticks);", stats)
+                    sf("}")
+                sf("}")
+            sf("}")
+            sf()
+            sf("/// Reset the call statistics of the commands")
+            sf("void reset%s() nothrow @nogc {", self.commandStats)
+            with sf.indentBlock():
+                sf("foreach (ref s; _%s) {", stats)
+                with sf.indentBlock():
+                    sf("atomicStore(s.calls, 0UL);")
+                    sf("atomicStore(s.ticks, 0UL);")
+                sf("}")
+            sf("}")
+            sf()
+            sf("// start of a call, in MonoTime ticks with gld_profile_timing")
+            sf("private long %sProfileStart() nothrow @nogc {", self.base.lower())
+            with sf.indentBlock():
+                sf("version(gld_profile_timing) return MonoTime.currTime.ticks;")
+                sf("else return 0;")
+            sf("}")
+            sf()
+            sf("// count a call of the command id, started at start")
+            sf("private void %sProfileEnd(uint id, long start) nothrow @nogc {", self.base.lower())
+            with sf.indentBlock():
+                sf("atomicOp!\"+=\"(_%s[id].calls, 1);", stats)
+                sf("version(gld_profile_timing) {")
+                with sf.indentBlock():
+                    sf("atomicOp!\"+=\"(_%s[id].ticks, MonoTime.currTime.ticks - start);", stats)
+                sf("}")
+            sf("}")
+        sf("}")
+
+    # encodedArrays - parameters of cmd pointing to arrays copied by the
+    # command encoder: constant arrays of known size without pointers
+    def encodedArrays(self, cmd):
+        return [ p for p in cmd.params if p.type.startswith("const(") and p.type.endswith("*") and
+                    "*" not in p.type[:-1] and self.arraySize(cmd, p) != None ]
+
+    # encodedCommands - commands recorded by the command encoder: those not
+    # returning a value, and not writing through a pointer parameter (queries
+    # such as GetShaderInfoLog or GenTextures, whose output would only be
+    # written at replay)
+    def encodedCommands(self):
+        return [ cmd for cmd in self.commands if cmd.type == "void" and
+                    not any(p.type.endswith("*") and not p.type.startswith("const(") for p in cmd.params) ]
+
+    # issueCommandEncoder - struct recording calls of the loader class
+    # methods in a buffer, replayed against a loader class by the replay
+    # function. Each record is a header (command id and size) followed by
+    # the arguments packed in a GlPacked struct. The arrays copied in the
+    # buffer are records of their own, and the pointer argument is replaced
+    # by a marker (offset of the copy + 1).
+    def issueCommandEncoder(self, sf):
+        cmds = self.encodedCommands()
+        if not len(cmds): return
+        encoded = set(cmd.field for cmd in cmds)
+        replay = self.base.lower() + "Replay"
+        record = self.base + "CommandRecord"
+        packed = self.base + "Packed"
+        arrayRecord = self.base.lower() + "ArrayRecord"
+
+        sf()
+        sf("// header of a record of %s", self.commandEncoder)
+        sf("private struct %s {", record)
+        with sf.indentBlock():
+            sf("uint id;    // %s, or %s", self.commandEnum, arrayRecord)
+            sf("uint size;  // size of the record in bytes, header included")
+        sf("}")
+        sf()
+        sf("// id of the records holding an array passed to a recorded command")
+        sf("private enum uint %s = uint.max;", arrayRecord)
+        sf()
+        sf("// arguments of a recorded command")
+        sf("private struct %s(T...) {", packed)
+        with sf.indentBlock():
+            sf("T args;")
+        sf("}")
+
+        sf()
+        sf("/// Recorder of %s commands in a buffer that is executed later by %s, e.g. by the", self.opts.humanName, replay)
+        sf("/// thread of the context while the commands are recorded by worker threads.")
+        sf("/// The commands returning a value or writing through a pointer (queries, Gen*...)")
+        sf("/// cannot be recorded. The constant arrays whose length is given by the registry")
+        sf("/// are copied in the buffer, the other pointers (strings, offsets...) are recorded")
+        sf("/// as is and must be valid until the replay.")
+        sf("/// The buffer is allocated with the C heap, not the GC.")
+        sf("struct %s {", self.commandEncoder)
+        with sf.indentBlock():
+            sf("import core.exception : onOutOfMemoryError;")
+            sf("import core.stdc.stdlib : free, realloc;")
+            sf("import core.stdc.string : memcpy;")
+            sf()
+            sf("@disable this(this);")
+            sf()
+            sf("~this() nothrow @nogc {")
+            with sf.indentBlock():
+                sf("free(_data);")
+            sf("}")
+            sf()
+            sf("/// The recorded commands, to pass to %s. Valid until a command is recorded or", replay)
+            sf("/// the encoder is cleared or destroyed.")
+            sf("public const(ubyte)[] commands() const nothrow @nogc {")
+            with sf.indentBlock():
+                sf("return _data[0 .. _length];")
+            sf("}")
+            sf()
+            sf("/// Forget the recorded commands, keeping the buffer to record the next ones")
+            sf("public void clear() nothrow @nogc {")
+            with sf.indentBlock():
+                sf("_length = 0;")
+            sf("}")
+
+            for f in self.cores + self.extensions:
+                fcmds = [ cmd for cmd in f.cmds if cmd.field in encoded ]
+                if not len(fcmds): continue
+                sf()
+                for i, cmd in enumerate(fcmds):
+                    if i == 0:
+                        sf("/// Record the commands of %s", f.name)
+                    else:
+                        sf("/// ditto")
+                    self.issueEncoderMethod(sf, cmd)
+
+            sf()
+            sf("// append a record of size bytes after the header, returns its content")
+            sf("private ubyte* reserve(uint id, size_t size) nothrow @nogc {")
+            with sf.indentBlock():
+                sf("size = (%s.sizeof + size + 7) & ~cast(size_t)7;", record)
+                sf("assert(size <= uint.max, \"%s command too large to be recorded\");", self.opts.humanName)
+                sf("if (_length + size > _capacity) {")
+                with sf.indentBlock():
+                    sf("size_t capacity = _capacity ? _capacity : 4096;")
+                    sf("while (capacity < _length + size) capacity *= 2;")
+                    sf("auto data = cast(ubyte*)realloc(_data, capacity);")
+                    sf("if (data is null) onOutOfMemoryError();")
+                    sf("_data = data;")
+                    sf("_capacity = capacity;")
+                sf("}")
+                sf("auto header = cast(%s*)(_data + _length);", record)
+                sf("header.id = id;")
+                sf("header.size = cast(uint)size;")
+                sf("_length += size;")
+                sf("return cast(ubyte*)(header + 1);")
+            sf("}")
+            sf()
+            sf("// record a command with its arguments")
+            sf("private void put(P)(uint id, auto ref P packed) nothrow @nogc {")
+            with sf.indentBlock():
+                sf("memcpy(reserve(id, P.sizeof), &packed, P.sizeof);")
+            sf("}")
+            sf()
+            sf("// copy an array of size bytes passed to a command, returns the marker")
+            sf("// of the copy recorded in place of ptr")
+            sf("private T* array(T)(T* ptr, ulong size) nothrow @nogc {")
+            with sf.indentBlock():
+                sf("if (ptr is null) return null;")
+                sf("assert(size <= uint.max, \"%s array too large to be recorded\");", self.opts.humanName)
+                sf("auto copy = reserve(%s, cast(size_t)size);", arrayRecord)
+                sf("memcpy(copy, ptr, cast(size_t)size);")
+                sf("return cast(T*)(copy - _data + 1);")
+            sf("}")
+            sf()
+            sf("private ubyte* _data;")
+            sf("private size_t _length;")
+            sf("private size_t _capacity;")
+        sf("}")
+
+        attrs = "" if self.opts.methodAttributes == "none" else " nothrow @nogc"
+        sf()
+        sf("/// Execute with gl the commands recorded by a %s", self.commandEncoder)
+        sf("void %s(%s gl, const(ubyte)[] commands)%s {", replay, self.loaderClass, attrs)
+        with sf.indentBlock():
+            sf("// address of the copy of an array marked by a recorded argument")
+            sf("static T* array(T)(const(ubyte)[] commands, T* marker) {")
+            with sf.indentBlock():
+                sf("if (marker is null) return null;")
+                sf("return cast(T*)(commands.ptr + (cast(size_t)marker - 1));")
+            sf("}")
+            sf()
+            sf("size_t pos = 0;")
+            sf("while (pos < commands.length) {")
+            with sf.indentBlock():
+                sf("const header = cast(const(%s)*)(commands.ptr + pos);", record)
+                sf("const args = cast(const(ubyte)*)(header + 1);")
+                sf("switch (header.id) {")
+                for cmd in cmds:
+                    if not len(cmd.params):
+                        sf("case %s.%s:", self.commandEnum, cmd.field)
+                        with sf.indentBlock():
+                            sf("gl.%s();", cmd.field)
+                            sf("break;")
+                        continue
+                    # scoped, as a case cannot skip the declarations of the previous ones
+                    sf("case %s.%s: {", self.commandEnum, cmd.field)
+                    with sf.indentBlock():
+                        sf("auto a = *cast(%s!(%s)*)args;", packed, ", ".join(p.type for p in cmd.params))
+                        for p in self.encodedArrays(cmd):
+                            i = cmd.params.index(p)
+                            sf("a.args[%s] = array(commands, a.args[%s]);", i, i)
+                        sf("gl.%s(a.args);", cmd.field)
+                        sf("break;")
+                    sf("}")
+                sf("default:")
+                with sf.indentBlock():
+                    sf("// arrays")
+                    sf("break;")
+                sf("}")
+                sf("pos += header.size;")
+            sf("}")
+        sf("}")
+
+    # issueEncoderMethod - method of the command encoder recording cmd
+    def issueEncoderMethod(self, sf, cmd):
+        paramStr = ", ".join(map((lambda p: "{} {}".format(p.type, p.name)), cmd.params))
+        sf("public void %s (%s) nothrow @nogc {", cmd.field, paramStr)
+        with sf.indentBlock():
+            if not len(cmd.params):
+                sf("reserve(%s.%s, 0);", self.commandEnum, cmd.field)
+            else:
+                arrays = self.encodedArrays(cmd)
+                args = []
+                for p in cmd.params:
+                    if p in arrays:
+                        sf("const %sCopy = array(%s, %s);", p.name, p.name, self.arraySize(cmd, p))
+                        args.append(p.name + "Copy")
+                    else:
+                        args.append(p.name)
+                sf("put(%s.%s, %s!(%s)(%s));", self.commandEnum, cmd.field,
+                        self.base + "Packed", ", ".join(p.type for p in cmd.params), ", ".join(args))
+        sf("}")
+
+    # filterStates - (StateDef, keys) of the states of stateDefs set by issued
+    # commands, with the key enums shadowed (None for a single state), and
+    # the issued commands by field
+    def filterStates(self):
+        cmds = { cmd.field: cmd for f in self.cores + self.extensions for cmd in f.cmds }
+        states = []
+        names = set()
+        for s in stateDefs:
+            setters = [ cmds[c] for c in s.setters if c in cmds ]
+            if not len(setters): continue
+            if s.perUnit and "activeTexture" not in names: continue
+            keys = None
+            if s.key != None:
+                keys = self.stateKeys(s, setters[0])
+                if not len(keys): continue
+            states.append((s, keys))
+            names.add(s.name)
+        return states, cmds
+
+    # stateKeys - issued enums of the registry group of the key parameter of
+    # s that have a query pname, without duplicate values
+    def stateKeys(self, s, cmd):
+        group = next(p.group for p in cmd.params if p.name == s.key)
+        info = None
+        if group != None:
+            info = self.registry.lookupElementInfo(group, self.registry.groupdict)
+        if info == None: return []
+        keys = []
+        values = set()
+        for name in groupRecord(info).enums:
+            value = self.enumValues.get(name)
+            if value == None or value in values: continue
+            if s.query != None and s.query(name) not in self.enumValues: continue
+            keys.append(name)
+            values.add(value)
+        return keys
+
+    # stateValueType - D type of the value of s
+    def stateValueType(self, s, cmds):
+        for c, expr in s.setters.items():
+            if expr == None and c in cmds:
+                return next(p.type for p in cmds[c].params if p.name != s.key)
+        return "bool"
+
+    # stateForward - statement forwarding a call of cmd to the loader class
+    def stateForward(self, cmd):
+        return "return _gl.{}({});".format(cmd.field, ", ".join(p.name for p in cmd.params))
+
+    # issueStateFilter - class wrapping the loader class, shadowing the states
+    # of stateDefs to drop the commands setting them to their current value
+    # and to answer their queries without a driver round-trip
+    def issueStateFilter(self, sf):
+        states, cmds = self.filterStates()
+        if not len(states): return
+        attrs = "" if self.opts.methodAttributes == "none" else " nothrow @nogc"
+
+        setters = {}
+        invalidators = {}
+        isQueries = {}
+        for s, keys in states:
+            for c, expr in s.setters.items():
+                setters[c] = (s, keys, expr)
+            for c in s.invalidatedBy:
+                invalidators.setdefault(c, []).append((s, keys))
+            if s.isQuery != None:
+                isQueries[s.isQuery] = (s, keys)
+        for c in stateResetCommands:
+            invalidators[c] = None
+        # states held by the bound vertex array
+        vertexArrayLines = []
+        for s, keys in states:
+            for k in s.vertexArrayKeys:
+                if keys != None and k in keys:
+                    assert not s.perUnit
+                    vertexArrayLines.append("_{}Known[{}] = false;".format(s.name, keys.index(k)))
+
+        queries = [ c for c in list(isQueries) + [ "GetIntegerv" ] if c in cmds ]
+        sf()
+        sf("/// Shadow of the %s states set through a %s: the commands setting a state",
+                self.opts.humanName, self.loaderClass)
+        sf("/// to its current value are not sent to the driver.")
+        if len(queries):
+            sf("/// The queries of the shadowed states (%s) are answered without a", ", ".join(queries))
+            sf("/// driver round-trip when the state is known.")
+        sf("/// The other commands are forwarded to the %s.", self.loaderClass)
+        sf("/// The states are unknown until set through the filter, and a command raising an")
+        sf("/// error still updates the shadow. Call invalidate when other code uses the context.")
+        sf("final class %s {", self.stateFilterClass)
+        with sf.indentBlock():
+            sf("this(%s gl) {", self.loaderClass)
+            with sf.indentBlock():
+                sf("_gl = gl;")
+            sf("}")
+            sf()
+            sf("/// The filtered %s", self.loaderClass)
+            sf("public inout(%s) gl() inout nothrow @nogc {", self.loaderClass)
+            with sf.indentBlock():
+                sf("return _gl;")
+            sf("}")
+            sf()
+            sf("alias gl this;")
+            sf()
+            sf("/// Forget the shadowed states: the next command setting each of them is")
+            sf("/// sent to the driver.")
+            sf("public void invalidate() nothrow @nogc {")
+            with sf.indentBlock():
+                for s, keys in states:
+                    sf("_%sKnown[] = false;", s.name)
+            sf("}")
+
+            if any(s.perUnit for s, keys in states):
+                sf()
+                sf("private enum textureUnits = %s;", stateTextureUnits)
+            for s, keys in states:
+                if keys != None:
+                    self.issueStateIndex(sf, s, keys)
+
+            for cmd in self.commands:
+                if cmd.field in setters:
+                    s, keys, expr = setters[cmd.field]
+                    lines = vertexArrayLines if s.name == "vertexArray" else []
+                    self.issueStateSetter(sf, cmd, s, keys, expr, lines, attrs)
+                elif cmd.field in invalidators:
+                    lines = []
+                    if invalidators[cmd.field] == None:
+                        lines.append("invalidate();")
+                    else:
+                        for s, keys in invalidators[cmd.field]:
+                            lines.append("_{}Known[] = false;".format(s.name))
+                            if s.name == "vertexArray":
+                                lines += vertexArrayLines
+                    sf()
+                    self.issueStateMethod(sf, cmd, attrs)
+                    with sf.indentBlock():
+                        for l in lines:
+                            sf(l)
+                        sf(self.stateForward(cmd))
+                    sf("}")
+                elif cmd.field in isQueries:
+                    s, keys = isQueries[cmd.field]
+                    key = cmd.params[0].name
+                    sf()
+                    self.issueStateMethod(sf, cmd, attrs)
+                    with sf.indentBlock():
+                        sf("const _i = %sIndex(%s);", s.name, key)
+                        sf("if (_i >= 0 && _%sKnown[_i]) return cast(%s)_%s[_i];",
+                                s.name, cmd.type, s.name)
+                        sf(self.stateForward(cmd))
+                    sf("}")
+                elif cmd.field == "GetIntegerv":
+                    self.issueStateQuery(sf, cmd, states, attrs)
+
+            sf()
+            sf("private %s _gl;", self.loaderClass)
+            for s, keys in states:
+                count = 1
+                if keys != None:
+                    count = len(keys) * (stateTextureUnits if s.perUnit else 1)
+                sf("// %s", ", ".join(c for c in s.setters if c in cmds))
+                sf("private %s[%s] _%s;", self.stateValueType(s, cmds), count, s.name)
+                sf("private bool[%s] _%sKnown;", count, s.name)
+        sf("}")
+
+    def issueStateMethod(self, sf, cmd, attrs):
+        paramStr = ", ".join(map((lambda p: "{} {}".format(p.type, p.name)), cmd.params))
+        sf("public %s %s (%s)%s {", cmd.type, cmd.field, paramStr, attrs)
+
+    # issueStateIndex - function returning the index of the state of a key
+    # enum in the arrays of s, or -1 if the state is not shadowed
+    def issueStateIndex(self, sf, s, keys):
+        sf()
+        sf("private ptrdiff_t %sIndex(GLenum %s) const nothrow @nogc {", s.name, s.key)
+        with sf.indentBlock():
+            sf("ptrdiff_t slot;")
+            sf("switch (%s) {", s.key)
+            for i, k in enumerate(keys):
+                sf("case %s:", k)
+                with sf.indentBlock():
+                    sf("slot = %s;", i)
+                    sf("break;")
+            sf("default:")
+            with sf.indentBlock():
+                sf("return -1;")
+            sf("}")
+            if s.perUnit:
+                sf("// held by the active texture unit")
+                sf("if (!_activeTextureKnown[0]) return -1;")
+                sf("const unit = _activeTexture[0] - GL_TEXTURE0;")
+                sf("if (unit >= textureUnits) return -1;")
+                sf("return cast(ptrdiff_t)unit * %s + slot;", len(keys))
+            else:
+                sf("return slot;")
+        sf("}")
+
+    # issueStateSetter - method of a command setting s, returning early if
+    # the value is the shadowed one
+    #   lines - statements issued when the state changes
+    def issueStateSetter(self, sf, cmd, s, keys, expr, lines, attrs):
+        value = expr
+        if value == None:
+            value = next(p.name for p in cmd.params if p.name != s.key)
+        sf()
+        self.issueStateMethod(sf, cmd, attrs)
+        with sf.indentBlock():
+            if keys == None:
+                sf("if (_%sKnown[0] && _%s[0] == %s) return;", s.name, s.name, value)
+                sf("_%s[0] = %s;", s.name, value)
+                sf("_%sKnown[0] = true;", s.name)
+            else:
+                sf("const _i = %sIndex(%s);", s.name, s.key)
+                sf("if (_i >= 0) {")
+                with sf.indentBlock():
+                    sf("if (_%sKnown[_i] && _%s[_i] == %s) return;", s.name, s.name, value)
+                    sf("_%s[_i] = %s;", s.name, value)
+                    sf("_%sKnown[_i] = true;", s.name)
+                sf("}")
+            for l in lines:
+                sf(l)
+            sf(self.stateForward(cmd))
+        sf("}")
+
+    # issueStateQuery - glGetIntegerv answering the pnames of the shadowed
+    # states when they are known
+    def issueStateQuery(self, sf, cmd, states, attrs):
+        pname, data = cmd.params[0].name, cmd.params[1].name
+        sf()
+        self.issueStateMethod(sf, cmd, attrs)
+        with sf.indentBlock():
+            if any(s.perUnit and s.query != None for s, keys in states):
+                sf("ptrdiff_t _i;")
+            sf("switch (%s) {", pname)
+            values = set()
+            for s, keys in states:
+                if s.query == None: continue
+                if keys == None:
+                    queries = [ (s.query, "0") ]
+                elif s.perUnit:
+                    queries = [ (s.query(k), "_i") for k in keys ]
+                else:
+                    queries = [ (s.query(k), str(i)) for i, k in enumerate(keys) ]
+                for i, (q, index) in enumerate(queries):
+                    value = self.enumValues.get(q)
+                    if value == None or value in values: continue
+                    values.add(value)
+                    sf("case %s:", q)
+                    with sf.indentBlock():
+                        if index == "_i":
+                            sf("_i = %sIndex(%s);", s.name, keys[i])
+                            sf("if (_i >= 0 && _%sKnown[_i]) {", s.name)
+                        else:
+                            sf("if (_%sKnown[%s]) {", s.name, index)
+                        with sf.indentBlock():
+                            sf("*%s = cast(GLint)_%s[%s];", data, s.name, index)
+                            sf("return;")
+                        sf("}")
+                        sf("break;")
+            sf("default:")
+            with sf.indentBlock():
+                sf("break;")
+            sf("}")
+            sf(self.stateForward(cmd))
+        sf("}")
+
+    def issueAttributesCheck(self, sf):
+        sf()
+        sf("// Check that the public methods of %s are nothrow @nogc", self.loaderClass)
+        sf("unittest {")
+        with sf.indentBlock():
+            sf("import std.traits : hasFunctionAttributes;")
+            sf()
+            sf("static foreach (name; __traits(derivedMembers, %s)) {", self.loaderClass)
+            with sf.indentBlock():
+                sf("static if (name != \"__ctor\" &&")
+                sf("        __traits(getVisibility, __traits(getMember, %s, name)) == \"public\") {", self.loaderClass)
+                with sf.indentBlock():
+                    sf("static assert(hasFunctionAttributes!(__traits(getMember, %s, name), \"nothrow\", \"@nogc\"),", self.loaderClass)
+                    sf("        \"%s.\" ~ name ~ \" is not nothrow @nogc\");", self.loaderClass)
+                sf("}")
+            sf("}")
         sf("}")
 
     def issueExtensionsLoader(self, sf):
@@ -856,6 +2242,133 @@ class DGenerator(OutputGenerator):
 
 # generator options
 
+# styles of DGeneratorOptions.dispatchChecks
+dispatchChecksStyles = [ "assert", "version", "none" ]
+# styles of DGeneratorOptions.methodAttributes
+methodAttributesStyles = [ "none", "emit", "check" ]
+# output layouts of DGeneratorOptions.layout
+layoutStyles = [ "single", "feature", "vendor" ]
+# commands laid out first in the dispatch table: draw calls, binds, uniforms
+# and other per frame state changes
+defaultHotCommands = r"gl(Draw(Arrays|Elements|RangeElements)\w*|" \
+                     r"Bind(Buffer|Texture|VertexArray|Framebuffer|Renderbuffer|Sampler|" \
+                     r"ProgramPipeline|ImageTexture)\w*|Uniform\w*|UseProgram|ActiveTexture|" \
+                     r"(Enable|Disable)(VertexAttribArray|i)?|Clear(Color|Depthf?|Stencil|Buffer\w*)?|" \
+                     r"Viewport|Scissor|" \
+                     r"Blend(Func|Equation)\w*|Depth(Func|Mask)|ColorMask|CullFace|" \
+                     r"VertexAttrib\w*Pointer|BufferSubData|MapBufferRange|UnmapBuffer|" \
+                     r"TexSubImage[23]D|GetError)"
+
+# StateDef - a state shadowed by the state filter class
+#   name - name of the state in the filter
+#   setters - commands (without prefix) setting the state -> D expression of
+#     the value they set, or None for their value parameter
+#   key - parameter of the setters selecting the state among the enums of
+#     its group in the registry, or None for a single state
+#   query - glGetIntegerv pname of the state: function of the key enum name
+#     for a keyed state (None if the key has none), or the pname name.
+#     Keys without an issued pname are not shadowed (e.g. proxy targets).
+#   isQuery - command returning whether the state is set, e.g. IsEnabled
+#   perUnit - the state is held by each texture unit
+#   vertexArrayKeys - keys of the state held by the bound vertex array
+#   invalidatedBy - commands changing the state in a way that is not shadowed
+class StateDef(object):
+    def __init__(self, name, setters, key=None, query=None, isQuery=None,
+                 perUnit=False, vertexArrayKeys=[], invalidatedBy=[]):
+        self.name = name
+        self.setters = setters
+        self.key = key
+        self.query = query
+        self.isQuery = isQuery
+        self.perUnit = perUnit
+        self.vertexArrayKeys = vertexArrayKeys
+        self.invalidatedBy = invalidatedBy
+
+# states shadowed by the state filter class. activeTexture must precede
+# the perUnit states and vertexArray the states with vertexArrayKeys.
+stateDefs = [
+    StateDef("enabled", { "Enable": "true", "Disable": "false" }, key="cap",
+             query=lambda cap: cap, isQuery="IsEnabled",
+             invalidatedBy=[ "Enablei", "Disablei" ]),
+    StateDef("activeTexture", { "ActiveTexture": None }, query="GL_ACTIVE_TEXTURE"),
+    StateDef("textureBinding", { "BindTexture": None }, key="target",
+             query=lambda target: "GL_TEXTURE_BINDING_" + target[len("GL_TEXTURE_"):]
+                    if target.startswith("GL_TEXTURE_") else None,
+             perUnit=True,
+             invalidatedBy=[ "DeleteTextures", "BindTextures", "BindTextureUnit",
+                             "BindMultiTextureEXT" ]),
+    StateDef("vertexArray", { "BindVertexArray": None }, query="GL_VERTEX_ARRAY_BINDING",
+             invalidatedBy=[ "DeleteVertexArrays" ]),
+    StateDef("bufferBinding", { "BindBuffer": None }, key="target",
+             query=lambda target: target + "_BINDING",
+             vertexArrayKeys=[ "GL_ELEMENT_ARRAY_BUFFER" ],
+             invalidatedBy=[ "DeleteBuffers", "BindBufferBase", "BindBufferRange",
+                             "BindBuffersBase", "BindBuffersRange" ]),
+    StateDef("program", { "UseProgram": None }, query="GL_CURRENT_PROGRAM"),
+    StateDef("depthFunc", { "DepthFunc": None }, query="GL_DEPTH_FUNC"),
+    StateDef("cullFace", { "CullFace": None }, query="GL_CULL_FACE_MODE"),
+    StateDef("frontFace", { "FrontFace": None }, query="GL_FRONT_FACE"),
+]
+# commands restoring states that are not shadowed, invalidating all of them
+stateResetCommands = [ "PopAttrib", "PopClientAttrib" ]
+# texture units shadowed by the perUnit states
+stateTextureUnits = 32
+
+# DGeneratorOptions - options of DGenerator
+#
+# Additional members
+#   regFile - path to the registry XML file
+#   module - name of the generated D module
+#   humanName - name of the API in comments, e.g. 'OpenGL'
+#   cmdPrefix - prefix of the commands, stripped from the Gl methods
+#   importedStructDecls - structs declared in imported modules
+#   stmts - statements (usually imports) emitted after the module declaration
+#   incremental - write the file only if its content changed
+#   lazyLoading - resolve the symbol of each command at its first call
+#     instead of in the loader constructor. The loader must then stay valid
+#     for the lifetime of the loader class, and its methods are not const.
+#   extGatedLoading - also generate a loader constructor that only loads
+#     the commands of a version and of a list of supported extensions,
+#     and records the loaded extensions. Not compatible with lazyLoading.
+#   dispatchChecks - how the loader methods check that their command is
+#     loaded before calling it:
+#       'assert' - assert that the command is loaded
+#       'version' - same, unless the version gld_unchecked is defined
+#       'none' - no check, methods are plain forwarding calls
+#   methodAttributes - attributes of the loader methods:
+#       'none' - no attribute
+#       'emit' - methods are nothrow @nogc and pragma(inline, true)
+#       'check' - same, and a unittest checks that all the public methods
+#         of the loader class are nothrow @nogc
+#   layout - how the module is laid out in files:
+#       'single' - everything in filename
+#       'feature' - a package in the folder of filename without extension,
+#         with a module per version and per extension
+#       'vendor' - same, with a module per version and per extension vendor
+#   dispatchTable - lay out the dispatch struct (see issueDispatchTable)
+#     with the hot commands first, and give access to it from the loader
+#     class (e.g. Gl(in GlDispatch) and Gl.dispatch)
+#   hotCommands - regex matching the version commands laid out first in the
+#     dispatch table, as they are called every frame
+#   cloneConstructor - also generate a loader class constructor copying the
+#     commands of the loader of another context of the same driver
+#   perContextCommands - regex matching the commands that depend on the
+#     context, loaded again by the clone constructor
+#   profiling - also generate call statistics (count and time) per command,
+#     collected by the loader class methods if the version gld_profile is
+#     defined
+#   tracing - also generate the recording of the calls in a buffer if the
+#     version gld_trace is defined, and the metadata (.trace.json next to
+#     the module) used by gldtrace.py to decode the records
+#   streamingEmission - issue the sections of each feature to temporary
+#     files as soon as the feature is generated, and assemble the module
+#     from them at the end. Lowers the memory held by the generator for
+#     large APIs. Only with the single layout.
+#   stateFilter - also generate a class wrapping the loader class that
+#     drops the commands setting a state of stateDefs to its current value
+#     and answers the queries of these states
+#   commandEncoder - also generate a struct recording the loader class
+#     commands in a buffer and a function replaying it against a loader class
 class DGeneratorOptions(GeneratorOptions):
     """Represents options during C header production from an API registry"""
     def __init__(self,
@@ -873,7 +2386,22 @@ class DGeneratorOptions(GeneratorOptions):
                  humanName = "",
                  cmdPrefix = "",
                  importedStructDecls = [],
-                 stmts = []):
+                 stmts = [],
+                 incremental = False,
+                 lazyLoading = False,
+                 extGatedLoading = False,
+                 dispatchChecks = "assert",
+                 methodAttributes = "none",
+                 layout = "single",
+                 dispatchTable = False,
+                 hotCommands = defaultHotCommands,
+                 cloneConstructor = False,
+                 perContextCommands = None,
+                 profiling = False,
+                 tracing = False,
+                 streamingEmission = False,
+                 stateFilter = False,
+                 commandEncoder = False):
         GeneratorOptions.__init__(self, filename, apiname, profile,
                                   versions, emitversions, defaultExtensions,
                                   addExtensions, removeExtensions, sortProcedure)
@@ -883,3 +2411,18 @@ class DGeneratorOptions(GeneratorOptions):
         self.cmdPrefix = cmdPrefix
         self.importedStructDecls = importedStructDecls
         self.stmts = stmts
+        self.incremental = incremental
+        self.lazyLoading = lazyLoading
+        self.extGatedLoading = extGatedLoading
+        self.dispatchChecks = dispatchChecks
+        self.methodAttributes = methodAttributes
+        self.layout = layout
+        self.dispatchTable = dispatchTable
+        self.hotCommands = hotCommands
+        self.cloneConstructor = cloneConstructor
+        self.perContextCommands = perContextCommands
+        self.profiling = profiling
+        self.tracing = tracing
+        self.streamingEmission = streamingEmission
+        self.stateFilter = stateFilter
+        self.commandEncoder = commandEncoder
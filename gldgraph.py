@@ -0,0 +1,210 @@
+#! /usr/bin/env python3
+"""
+    Feature dependency graph of a registry.
+    Precomputes, for each feature (version or extension), the transitive
+    closure of the types, enums and commands it requires, following the
+    'requires' attribute of types and the <ptype> of commands. Requiring a
+    set of features is then the union of their closures.
+    Run as a script to export the graph of a registry for inspection.
+"""
+
+if __name__ == "__main__":
+    import sys
+    from os import path
+    sys.path.insert(0, path.join(path.dirname(path.realpath(__file__)), 'registry'))
+
+from reg import TypeInfo, EnumInfo, matchAPIProfile, noneStr
+from gldreg import TypeRecord, EnumRecord
+from gldreg import typeRecord, enumRecord, cmdRecord, featureRecord
+
+# Closure - what a feature requires and removes for an api and profile
+#   required - *Info objects (or records) required by the feature,
+#     dependencies included
+#   removed - *Info objects (or records) removed by the feature.
+#     Dependencies of removed types and commands are not removed,
+#     as they may be used elsewhere.
+class Closure:
+    def __init__(self, required, removed):
+        self.required = required
+        self.removed = removed
+
+# FeatureGraph - dependency graph of the features of a registry.
+# Works with the *Info objects of reg.py as well as with the records of
+# the compact model. Closures are computed on first use and kept for the
+# lifetime of the graph, so a registry generating several variants only
+# computes them once per api and profile.
+class FeatureGraph:
+    def __init__(self, registry):
+        self.registry = registry
+        # (api, profile) -> { feature name: Closure }
+        self.closures = {}
+        # api -> { type name: tuple of *Info of the type and its dependencies }
+        self.typeClosures = {}
+
+    # lookup - same as Registry.lookupElementInfo, for an explicit api
+    def lookup(self, name, dictionary, api):
+        key = (name, api)
+        if key in dictionary:
+            return dictionary[key]
+        return dictionary.get(name)
+
+    def feature(self, name, api):
+        info = self.lookup(name, self.registry.apidict, api)
+        if info == None:
+            info = self.lookup(name, self.registry.extdict, api)
+        if info == None:
+            raise KeyError("unknown feature: {}".format(name))
+        return info
+
+    def typeClosure(self, name, api):
+        types = self.typeClosures.setdefault(api, {})
+        if name in types:
+            return types[name]
+        info = self.lookup(name, self.registry.typedict, api)
+        if info == None:
+            closure = ()
+        else:
+            requires = typeRecord(info).requires
+            closure = (info,)
+            if requires != None:
+                closure += self.typeClosure(requires, api)
+        types[name] = closure
+        return closure
+
+    def blockClosure(self, block, api, required):
+        infos = set()
+        for name in block.types:
+            if required:
+                infos.update(self.typeClosure(name, api))
+            else:
+                info = self.lookup(name, self.registry.typedict, api)
+                if info != None: infos.add(info)
+        for name in block.enums:
+            info = self.lookup(name, self.registry.enumdict, api)
+            if info != None: infos.add(info)
+        for name in block.cmds:
+            info = self.lookup(name, self.registry.cmddict, api)
+            if info == None: continue
+            infos.add(info)
+            if required:
+                for ptype in cmdRecord(info).ptypes:
+                    infos.update(self.typeClosure(ptype, api))
+        return infos
+
+    # closure - Closure of the feature name for api and profile
+    def closure(self, name, api, profile):
+        closures = self.closures.setdefault((api, profile), {})
+        if name in closures:
+            return closures[name]
+        feature = featureRecord(self.feature(name, api))
+        required = set()
+        for block in feature.requires:
+            if matchAPIProfile(api, profile, block):
+                required |= self.blockClosure(block, api, True)
+        removed = set()
+        for block in feature.removes:
+            if matchAPIProfile(api, profile, block):
+                removed |= self.blockClosure(block, api, False)
+        closure = Closure(frozenset(required), frozenset(removed))
+        closures[name] = closure
+        return closure
+
+    # requiredBy - union of what the features in names require
+    def requiredBy(self, names, api, profile):
+        required = set()
+        for name in names:
+            required |= self.closure(name, api, profile).required
+        return required
+
+    # featureNames - names of the versions of api and of the extensions
+    # supporting it
+    def featureNames(self, api):
+        names = [ f.name for f in self.registry.apidict.values()
+                    if f.elem.get('api') in (None, api) ]
+        for e in self.registry.extensions:
+            if api in noneStr(e.get('supported')).split('|'):
+                names.append(e.get('name'))
+        return names
+
+    # export - plain value representation of the closures of the features
+    # in names (all features by default), suitable for JSON
+    def export(self, api, profile, names=None):
+        def byKind(infos):
+            kinds = { 'types': [], 'enums': [], 'commands': [] }
+            for info in infos:
+                kind, name = infoName(info)
+                kinds[kind].append(name)
+            return { k: sorted(v) for k, v in kinds.items() }
+
+        if names == None: names = self.featureNames(api)
+        features = {}
+        for name in names:
+            closure = self.closure(name, api, profile)
+            features[name] = {
+                'requires': byKind(closure.required),
+                'removes': byKind(closure.removed),
+            }
+        return { 'api': api, 'profile': profile, 'features': features }
+
+    # exportDot - Graphviz representation of the dependencies of the
+    # features in names (all features by default): edges go from the
+    # features to what they require, from the commands to their parameter
+    # types and from the types to the types they require
+    def exportDot(self, api, profile, names=None):
+        if names == None: names = self.featureNames(api)
+        lines = [ 'digraph "{}" {{'.format(api) ]
+        edges = set()
+        for name in names:
+            lines.append('    "{}" [shape=box];'.format(name))
+            for block in featureRecord(self.feature(name, api)).requires:
+                if not matchAPIProfile(api, profile, block): continue
+                for dep in block.types + block.enums + block.cmds:
+                    edges.add((name, dep))
+            for info in self.closure(name, api, profile).required:
+                kind, depName = infoName(info)
+                if kind == 'types':
+                    requires = typeRecord(info).requires
+                    if requires != None: edges.add((depName, requires))
+                elif kind == 'commands':
+                    for ptype in cmdRecord(info).ptypes:
+                        edges.add((depName, ptype))
+        for a, b in sorted(edges):
+            lines.append('    "{}" -> "{}";'.format(a, b))
+        lines.append('}')
+        return "\n".join(lines) + "\n"
+
+# infoName - kind ('types', 'enums' or 'commands') and name of an *Info
+# object or of a record
+def infoName(info):
+    if isinstance(info, (TypeInfo, TypeRecord)):
+        return 'types', typeRecord(info).name
+    if isinstance(info, (EnumInfo, EnumRecord)):
+        return 'enums', enumRecord(info).name
+    return 'commands', cmdRecord(info).name
+
+if __name__ == "__main__":
+
+    import json
+    import argparse
+    from gldreg import loadRegistry
+
+    parser = argparse.ArgumentParser(description='Export the feature dependency graph of a registry')
+    parser.add_argument('regFile', help="Registry XML file")
+    parser.add_argument('--api', dest='api', required=True,
+                        help="API of the features to export (e.g. gl)")
+    parser.add_argument('--profile', dest='profile',
+                        help="Profile of the features to export (e.g. core)")
+    parser.add_argument('--feature', dest='features', nargs="*",
+                        help="Features to export [all]")
+    parser.add_argument('--dot', dest='dot', action='store_true',
+                        help="Export the dependencies in Graphviz format instead of "
+                             "the closures in JSON")
+    args = parser.parse_args()
+
+    graph = FeatureGraph(loadRegistry(args.regFile, loader="stream"))
+    if args.dot:
+        sys.stdout.write(graph.exportDot(args.api, args.profile, args.features))
+    else:
+        json.dump(graph.export(args.api, args.profile, args.features),
+                  sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
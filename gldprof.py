@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+"""
+    Profiling hooks of gldgen.
+    The registry and the generator report their phases (parsing, passes of
+    apiGen, issue* emitters...) as events to the hooks registered here.
+    Setting the GLDGEN_TRACE environment variable to a file path appends
+    every event as a JSON line to that file. If GLDGEN_TRACE_ALLOC is also
+    set to 1, the memory allocated by each phase is measured as well.
+"""
+
+import json
+import os
+import time
+import tracemalloc
+
+# hooks - callables receiving each event, a dict with:
+#   phase - name of the phase
+#   duration - duration of the phase in seconds
+#   allocated - memory allocated (minus memory freed) during the phase in
+#     bytes, only if allocations are traced
+#   pid - id of the generating process
+#   error - name of the exception type, if the phase was left by one
+#   phase specific attributes (api, feature...) and counts
+hooks = []
+traceAllocations = False
+
+# addHook - register a hook
+#   allocations - also measure allocations (slows down the generation)
+def addHook(hook, allocations=False):
+    global traceAllocations
+    if allocations and not traceAllocations:
+        traceAllocations = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+    hooks.append(hook)
+
+def removeHook(hook):
+    hooks.remove(hook)
+
+# Phase - context manager timing a phase and reporting it to the hooks
+class Phase(object):
+    __slots__ = ('event', 'start', 'memory')
+
+    def __init__(self, name, attrs):
+        self.event = dict(attrs, phase=name, pid=os.getpid())
+
+    # count - add n to the count key of the event
+    def count(self, key, n=1):
+        self.event[key] = self.event.get(key, 0) + n
+
+    def __enter__(self):
+        if traceAllocations:
+            self.memory = tracemalloc.get_traced_memory()[0]
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.event['duration'] = time.perf_counter() - self.start
+        if traceAllocations:
+            self.event['allocated'] = tracemalloc.get_traced_memory()[0] - self.memory
+        if type != None:
+            self.event['error'] = type.__name__
+        for hook in hooks:
+            hook(self.event)
+        return False
+
+# NullPhase - phase used when no hook is registered
+class NullPhase(object):
+    def count(self, key, n=1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+nullPhase = NullPhase()
+
+# phase - context manager for the phase name.
+#   attrs - attributes added to the event
+# Usage:
+#   with gldprof.phase("parse", file=regFile) as ph:
+#       ...
+#       ph.count("elements", n)
+def phase(name, **attrs):
+    if not len(hooks):
+        return nullPhase
+    return Phase(name, attrs)
+
+# JsonTrace - hook appending the events as JSON lines to a file.
+# The file is appended to, so that several processes can share it.
+class JsonTrace(object):
+    def __init__(self, filename):
+        self.file = open(filename, mode="a")
+
+    def __call__(self, event):
+        self.file.write(json.dumps(event, sort_keys=True) + "\n")
+        self.file.flush()
+
+if os.environ.get("GLDGEN_TRACE"):
+    addHook(JsonTrace(os.environ["GLDGEN_TRACE"]),
+            allocations=os.environ.get("GLDGEN_TRACE_ALLOC") == "1")
@@ -0,0 +1,572 @@
+#! /usr/bin/env python3
+"""
+    Registry support for gldgen.
+    reg.py is copied verbatim from the Khronos registry (see copy_reg.py),
+    so what gldgen adds on top of it lives here.
+"""
+
+import hashlib
+import os
+import pickle
+import sys
+import time
+from collections import namedtuple
+from os import path
+
+import xml.etree.ElementTree as etree
+
+import gldprof
+import reg
+from reg import Registry, matchAPIProfile, noneStr
+
+# Compact registry model
+#
+# Element free records holding what the generator reads from the registry.
+# They follow the interface of the *Info classes of reg.py (required,
+# declared, resetState) so that Registry.apiGen can drive them.
+# Each record can be turned into a tuple of plain values (state) and
+# rebuilt from it, which is what the registry cache stores.
+
+class RecordBase(object):
+    __slots__ = ('required', 'declared')
+
+    def resetState(self):
+        self.required = False
+        self.declared = False
+
+# TypeRecord - a <type>
+#   requires - name of the type required by this type, or None
+#   decl - text of the declaration, or None if the type has no <name>
+class TypeRecord(RecordBase):
+    __slots__ = ('name', 'api', 'requires', 'decl')
+
+    def __init__(self, name, api, requires, decl):
+        self.resetState()
+        self.name = name
+        self.api = api
+        self.requires = requires
+        self.decl = decl
+
+    def state(self):
+        return (self.name, self.api, self.requires, self.decl)
+
+# GroupRecord - a <group>
+#   enums - names of the enums in the group
+class GroupRecord(RecordBase):
+    __slots__ = ('name', 'api', 'enums')
+
+    def __init__(self, name, api, enums):
+        self.resetState()
+        self.name = name
+        self.api = api
+        self.enums = enums
+
+    def state(self):
+        return (self.name, self.api, self.enums)
+
+# EnumRecord - an <enum>
+#   type - value of the 'type' attribute, '' if absent
+class EnumRecord(RecordBase):
+    __slots__ = ('name', 'api', 'value', 'alias', 'type')
+
+    def __init__(self, name, api, value, alias, type):
+        self.resetState()
+        self.name = name
+        self.api = api
+        self.value = value
+        self.alias = alias
+        self.type = noneStr(type)
+
+    def state(self):
+        return (self.name, self.api, self.value, self.alias, self.type)
+
+# ParamRecord - a <param> of a command
+#   decl - C type of the parameter (text of the param without its name)
+#   len, group - values of the 'len' and 'group' attributes, or None
+ParamRecord = namedtuple('ParamRecord', 'name decl len group')
+
+# CmdRecord - a <command>
+#   alias - name of the aliased command, or None
+#   proto - C return type (text of the proto without the name), or None
+#   params - tuple of ParamRecord
+#   ptypes - all the types referenced with <ptype> by the command
+class CmdRecord(RecordBase):
+    __slots__ = ('name', 'api', 'alias', 'proto', 'params', 'ptypes')
+
+    def __init__(self, name, api, alias, proto, params, ptypes):
+        self.resetState()
+        self.name = name
+        self.api = api
+        self.alias = alias
+        self.proto = proto
+        self.params = params
+        self.ptypes = ptypes
+
+    def state(self):
+        return (self.name, self.api, self.alias, self.proto,
+                tuple(tuple(p) for p in self.params), self.ptypes)
+
+    @staticmethod
+    def fromState(state):
+        name, api, alias, proto, params, ptypes = state
+        return CmdRecord(name, api, alias, proto,
+                         tuple(ParamRecord._make(p) for p in params), ptypes)
+
+# BlockRecord - a <require> or <remove> block of a feature
+#   attrib - its 'api' and 'profile' attributes, such as matchAPIProfile
+#     can be used on the block
+class BlockRecord(namedtuple('BlockRecord', 'attrib types enums cmds')):
+    __slots__ = ()
+
+    def get(self, key):
+        return self.attrib.get(key)
+
+# FeatureRecord - a <feature> or <extension>
+# Registry.apiGen hands feature elements (FeatureInfo.elem) to the generator
+# and to the requireAndRemoveFeatures and generateRequiredInterface passes.
+# The record stands for its own element: elem is the record itself and
+# tag and get() give access to the element attributes.
+#   requires, removes - tuples of BlockRecord
+class FeatureRecord(RecordBase):
+    __slots__ = ('elem', 'tag', 'attrib', 'name', 'category', 'number', 'emit',
+                 'requires', 'removes')
+
+    def __init__(self, tag, attrib, requires, removes):
+        self.resetState()
+        self.elem = self
+        self.tag = tag
+        self.attrib = attrib
+        self.name = attrib.get('name')
+        if (tag == 'feature'):
+            self.category = 'VERSION'
+            self.number = attrib.get('number')
+        else:
+            self.category = self.name.split('_', 2)[1]
+            self.number = "0"
+        self.emit = False
+        self.requires = requires
+        self.removes = removes
+
+    def get(self, key):
+        return self.attrib.get(key)
+
+    def state(self):
+        return (self.tag, self.attrib,
+                tuple(tuple(b) for b in self.requires),
+                tuple(tuple(b) for b in self.removes))
+
+    @staticmethod
+    def fromState(state):
+        tag, attrib, requires, removes = state
+        return FeatureRecord(tag, attrib,
+                             tuple(BlockRecord._make(b) for b in requires),
+                             tuple(BlockRecord._make(b) for b in removes))
+
+# Record extraction from the registry elements
+#
+# Names and other strings repeated across the registry (types of params,
+# names referenced in the features...) are interned so that all the records
+# share a single copy of each.
+
+def istr(s):
+    return None if s == None else sys.intern(s)
+
+def extractType(elem):
+    name = elem.get('name')
+    nameEl = elem.find('name')
+    if name == None:
+        name = nameEl.text
+    decl = None
+    if nameEl != None and len(noneStr(nameEl.text)):
+        decl = noneStr(elem.text)
+        for el in elem:
+            decl += noneStr(el.text)
+            decl += noneStr(el.tail)
+    return TypeRecord(istr(name), istr(elem.get('api')), istr(elem.get('requires')), decl)
+
+def extractGroup(elem):
+    enums = tuple(istr(e.get('name')) for e in elem.findall('enum'))
+    return GroupRecord(istr(elem.get('name')), istr(elem.get('api')), enums)
+
+def extractEnum(elem):
+    return EnumRecord(istr(elem.get('name')), istr(elem.get('api')), elem.get('value'),
+                      istr(elem.get('alias')), istr(elem.get('type')))
+
+def extractCmd(elem):
+    name = elem.get('name')
+    if name == None:
+        name = elem.find('proto/name').text
+    alias = elem.find('alias')
+    if alias != None:
+        alias = alias.get('name')
+    proto = elem.find('proto')
+    if proto != None:
+        returnType = noneStr(proto.text)
+        for el in proto:
+            if el.tag != 'name':
+                returnType += noneStr(el.text)
+            returnType += noneStr(el.tail)
+        proto = returnType
+    params = []
+    for pel in elem.findall('.//param'):
+        decl = noneStr(pel.text)
+        for el in pel:
+            if el.tag != 'name': decl += noneStr(el.text)
+            decl += noneStr(el.tail)
+        params.append(ParamRecord(istr(pel.find('name').text), istr(decl),
+                                  pel.get('len'), istr(pel.get('group'))))
+    ptypes = tuple(istr(pt.text) for pt in elem.findall('.//ptype'))
+    return CmdRecord(istr(name), istr(elem.get('api')), istr(alias), istr(proto),
+                     tuple(params), ptypes)
+
+def extractFeature(elem):
+    def block(b):
+        attrib = { k: b.get(k) for k in ('api', 'profile') if k in b.attrib }
+        return BlockRecord(attrib,
+            tuple(istr(t.get('name')) for t in b.findall('type')),
+            tuple(istr(e.get('name')) for e in b.findall('enum')),
+            tuple(istr(c.get('name')) for c in b.findall('command')))
+    attrib = { k: v for k, v in elem.attrib.items()
+                    if k in ('name', 'api', 'number', 'supported', 'protect') }
+    return FeatureRecord(elem.tag, attrib,
+                         tuple(block(b) for b in elem.findall('require')),
+                         tuple(block(b) for b in elem.findall('remove')))
+
+# streamedElements - paths (from the root) of the elements turned into
+# records, with the index of their list in the result of streamRecords and
+# the extraction function
+streamedElements = {
+    ('types', 'type'): (0, extractType),
+    ('groups', 'group'): (1, extractGroup),
+    ('enums', 'enum'): (2, extractEnum),
+    ('commands', 'command'): (3, extractCmd),
+    ('feature',): (4, extractFeature),
+    ('extensions', 'extension'): (5, extractFeature),
+}
+
+def streamRecords(regFile):
+    """
+    Extract the records of regFile while it is parsed with iterparse.
+    Elements are removed from the tree once their record is extracted,
+    so the whole tree is never held in memory.
+    Returns the lists of type, group, enum, command, feature and extension
+    records, as taken by CompactRegistry.loadRecords.
+    """
+    records = ([], [], [], [], [], [])
+    # elements from the root to the current one
+    parents = []
+    for event, elem in etree.iterparse(regFile, events=('start', 'end')):
+        if event == 'start':
+            parents.append(elem)
+            continue
+        parents.pop()
+        # records are children or grand-children of the root
+        if len(parents) == 0 or len(parents) > 2:
+            continue
+        key = tuple(p.tag for p in parents[1:]) + (elem.tag,)
+        if key in streamedElements:
+            index, extract = streamedElements[key]
+            records[index].append(extract(elem))
+        elif len(parents) > 1:
+            # not a record, released with its parent
+            continue
+        parents[-1].remove(elem)
+    return records
+
+# typeRecord, groupRecord, enumRecord, cmdRecord - record for an Info object
+# of reg.py, or for a record of the compact model
+def typeRecord(info):
+    return info if isinstance(info, TypeRecord) else extractType(info.elem)
+
+def groupRecord(info):
+    return info if isinstance(info, GroupRecord) else extractGroup(info.elem)
+
+def enumRecord(info):
+    return info if isinstance(info, EnumRecord) else extractEnum(info.elem)
+
+def cmdRecord(info):
+    return info if isinstance(info, CmdRecord) else extractCmd(info.elem)
+
+def featureRecord(info):
+    return info.elem if isinstance(info.elem, FeatureRecord) else extractFeature(info.elem)
+
+
+# CompactRegistry - Registry which holds the compact model instead of
+# the element-backed *Info objects.
+# The element tree is released once parsed, so the methods of Registry
+# walking the tree (dumpReg, validateGroups) are not available.
+# The passes of apiGen that walk the elements are overriden to walk the
+# records instead.
+class CompactRegistry(Registry):
+    """Registry holding element free records"""
+
+    def __init__(self):
+        super().__init__()
+        self.graph = None
+        # records marked as required since the last apiReset
+        self.marked = set()
+
+    def addRecord(self, rec, infoName, dictionary):
+        if rec.api != None:
+            key = (rec.name, rec.api)
+        else:
+            key = rec.name
+        if key in dictionary:
+            self.gen.logMsg('warn', '*** Attempt to redefine',
+                            infoName, 'with key:', key)
+        else:
+            dictionary[key] = rec
+
+    def parseTree(self):
+        root = self.tree.getroot()
+        self.loadRecords(
+            [ extractType(t) for t in root.findall('types/type') ],
+            [ extractGroup(g) for g in root.findall('groups/group') ],
+            [ extractEnum(e) for e in root.findall('enums/enum') ],
+            [ extractCmd(c) for c in root.findall('commands/command') ],
+            [ extractFeature(f) for f in root.findall('feature') ],
+            [ extractFeature(e) for e in root.findall('extensions/extension') ]
+        )
+        self.tree = None
+
+    def loadRecords(self, types, groups, enums, cmds, features, extensions):
+        self.typedict = {}
+        for t in types:
+            self.addRecord(t, 'type', self.typedict)
+        self.groupdict = {}
+        for g in groups:
+            self.addRecord(g, 'group', self.groupdict)
+        self.enumdict = {}
+        for e in enums:
+            self.addRecord(e, 'enum', self.enumdict)
+        self.cmddict = {}
+        for c in cmds:
+            self.addRecord(c, 'command', self.cmddict)
+        self.apidict = {}
+        for f in features:
+            self.addElementInfo(f, f, 'feature', self.apidict)
+        self.extensions = extensions
+        self.extdict = {}
+        for e in extensions:
+            self.addElementInfo(e, e, 'extension', self.extdict)
+
+    def loadStream(self, regFile):
+        """Load the registry from regFile without building its element tree"""
+        with gldprof.phase("loadStream", file=regFile):
+            self.loadRecords(*streamRecords(regFile))
+
+    def state(self):
+        """Plain value representation of the registry, suitable to pickle"""
+        def states(dictionary):
+            return [ r.state() for r in dictionary.values() ]
+        return (
+            states(self.typedict),
+            states(self.groupdict),
+            states(self.enumdict),
+            states(self.cmddict),
+            states(self.apidict),
+            [ e.state() for e in self.extensions ],
+        )
+
+    def loadState(self, state):
+        """Load the registry from the result of state()"""
+        types, groups, enums, cmds, features, extensions = state
+        self.loadRecords(
+            [ TypeRecord(*t) for t in types ],
+            [ GroupRecord(*g) for g in groups ],
+            [ EnumRecord(*e) for e in enums ],
+            [ CmdRecord.fromState(c) for c in cmds ],
+            [ FeatureRecord.fromState(f) for f in features ],
+            [ FeatureRecord.fromState(e) for e in extensions ]
+        )
+
+    def featureGraph(self):
+        """FeatureGraph of the registry, built on first use"""
+        if self.graph == None:
+            from gldgraph import FeatureGraph
+            self.graph = FeatureGraph(self)
+        return self.graph
+
+    # the transitive closures of the features are computed once by the
+    # feature graph, and reused by all apiGen calls, instead of walking
+    # the dependencies of each feature in markRequired
+    def requireAndRemoveFeatures(self, interface, api, profile):
+        closure = self.featureGraph().closure(interface.name, api, profile)
+        for info in closure.required:
+            info.required = True
+        for info in closure.removed:
+            info.required = False
+        self.marked |= closure.required
+
+    # only records required by an apiGen can have been declared, so only
+    # those are reset, which keeps generating many variants from a registry
+    # cheap
+    def apiReset(self):
+        for info in self.marked:
+            info.resetState()
+        self.marked = set()
+        for feature in self.apidict.values():
+            feature.resetState()
+
+    def generateFeature(self, fname, ftype, dictionary, genProc):
+        f = self.lookupElementInfo(fname, dictionary)
+        if (f == None or not f.required or f.declared):
+            return
+        if (ftype == 'type'):
+            if (f.requires != None):
+                self.generateFeature(f.requires, 'type', self.typedict,
+                                     self.gen.genType)
+        elif (ftype == 'command'):
+            for depname in f.ptypes:
+                self.generateFeature(depname, 'type', self.typedict,
+                                     self.gen.genType)
+        if self.emitFeatures:
+            genProc(f, fname)
+        f.declared = True
+
+    def generateRequiredInterface(self, interface):
+        for features in interface.requires:
+            for name in features.types:
+                self.generateFeature(name, 'type', self.typedict,
+                                     self.gen.genType)
+            for name in features.enums:
+                self.generateFeature(name, 'enum', self.enumdict,
+                                     self.gen.genEnum)
+            for name in features.cmds:
+                self.generateFeature(name, 'command', self.cmddict,
+                                     self.gen.genCmd)
+
+
+# RegistryHooks - mixin reporting the phases of a Registry to gldprof.
+# Must precede the Registry class in the bases so that its methods wrap
+# the ones of the registry model.
+class RegistryHooks(object):
+
+    def __init__(self):
+        super().__init__()
+        # phase of the feature being generated
+        self.curPhase = None
+
+    def parseTree(self):
+        with gldprof.phase("parseTree"):
+            super().parseTree()
+
+    def apiGen(self, genOpts):
+        with gldprof.phase("apiGen", api=genOpts.apiname):
+            super().apiGen(genOpts)
+
+    def requireAndRemoveFeatures(self, interface, api, profile):
+        with gldprof.phase("requireAndRemoveFeatures", api=api,
+                           feature=interface.get('name')):
+            super().requireAndRemoveFeatures(interface, api, profile)
+
+    # the types, enums and commands generated are counted (e.g. types), and
+    # the time spent in the generator for them summed (e.g. typeDuration),
+    # by wrapping genProc in generateFeature
+    def generateRequiredInterface(self, interface):
+        with gldprof.phase("generateRequiredInterface", api=self.genOpts.apiname,
+                           feature=interface.get('name')) as ph:
+            self.curPhase = ph
+            try:
+                super().generateRequiredInterface(interface)
+            finally:
+                self.curPhase = None
+
+    def generateFeature(self, fname, ftype, dictionary, genProc):
+        ph = self.curPhase
+        if ph == None or ph is gldprof.nullPhase:
+            super().generateFeature(fname, ftype, dictionary, genProc)
+            return
+        def countingGenProc(info, name):
+            ph.count(ftype + 's')
+            start = time.perf_counter()
+            genProc(info, name)
+            ph.count(ftype + 'Duration', time.perf_counter() - start)
+        super().generateFeature(fname, ftype, dictionary, countingGenProc)
+
+class ProfiledRegistry(RegistryHooks, Registry):
+    """Registry reporting its phases to gldprof"""
+
+class ProfiledCompactRegistry(RegistryHooks, CompactRegistry):
+    """CompactRegistry reporting its phases to gldprof"""
+
+
+# Registry cache
+#
+# The compact model of a registry is pickled in a cache directory.
+# Entries are keyed by a hash of the registry XML file and of the sources
+# defining the model (reg.py and this module), so that a new registry or
+# an update of the generator never hits a stale entry.
+
+def registryKey(regFile):
+    h = hashlib.sha256()
+    for f in (regFile, reg.__file__, __file__):
+        with open(f, 'rb') as file:
+            h.update(file.read())
+    return h.hexdigest()[:32]
+
+def parseRegistry(regFile):
+    with gldprof.phase("parse", file=regFile):
+        return etree.parse(regFile)
+
+# registry loaders selectable in loadRegistry
+#   'tree' - parse the whole element tree, kept alive with the registry
+#   'compact' - parse the whole element tree, turn it into the compact
+#     model and release it
+#   'stream' - extract the compact model while parsing with iterparse
+registryLoaders = [ "tree", "compact", "stream" ]
+
+def loadRegistry(regFile, cacheDir=None, loader="tree"):
+    """
+    Load the registry in regFile with one of registryLoaders.
+    With a cacheDir, the compact model is loaded from the cache if present,
+    otherwise it is streamed from regFile and stored in the cache.
+    """
+    if loader not in registryLoaders:
+        raise ValueError("unknown registry loader: {}".format(loader))
+
+    if cacheDir == None:
+        if loader == "stream":
+            registry = ProfiledCompactRegistry()
+            registry.loadStream(regFile)
+        elif loader == "compact":
+            registry = ProfiledCompactRegistry()
+            registry.loadElementTree(parseRegistry(regFile))
+        else:
+            registry = ProfiledRegistry()
+            registry.loadElementTree(parseRegistry(regFile))
+        return registry
+
+    base = path.basename(regFile)
+    cacheFile = path.join(cacheDir, "{}-{}.regcache".format(base, registryKey(regFile)))
+
+    registry = ProfiledCompactRegistry()
+    try:
+        with gldprof.phase("loadCache", file=cacheFile):
+            with open(cacheFile, 'rb') as file:
+                registry.loadState(pickle.load(file))
+        return registry
+    except FileNotFoundError:
+        pass
+    except Exception as ex:
+        # unreadable entry, it is rewritten below
+        registry.gen.logMsg('warn', 'discarding registry cache', cacheFile, ':', ex)
+
+    registry.loadStream(regFile)
+
+    os.makedirs(cacheDir, exist_ok=True)
+    # write and rename to not expose a partial entry to a concurrent reader
+    tmpFile = "{}.{}.tmp".format(cacheFile, os.getpid())
+    with open(tmpFile, 'wb') as file:
+        pickle.dump(registry.state(), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmpFile, cacheFile)
+
+    # entries for previous versions of this registry are not needed anymore
+    for f in os.listdir(cacheDir):
+        if f.startswith(base+'-') and f.endswith('.regcache') and f != path.basename(cacheFile):
+            try:
+                os.remove(path.join(cacheDir, f))
+            except OSError:
+                pass
+
+    return registry
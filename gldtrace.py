@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+"""
+    Analyzer of the call traces recorded by the bindings generated with
+    --tracing when the version gld_trace is defined.
+    A trace is the concatenation of the words returned by glTraceTake (in
+    the byte order of the traced machine), decoded with the metadata written
+    next to the module (e.g. gl.trace.json).
+    Reports the calls per frame, the redundant state changes and the states
+    changing the most per frame.
+"""
+
+import json
+import re
+from array import array
+from collections import Counter
+
+# commands setting a state that a redundant call sets again to the same
+# value, without the API prefix
+defaultStateCommands = r"(Enable|Disable)\w*|Bind\w*|Use\w*|ActiveTexture|" \
+                       r"Blend(Func|Equation|Color)\w*|Depth(Func|Mask|Range\w*)|ColorMask\w*|" \
+                       r"CullFace|FrontFace|PolygonMode|PolygonOffset|Stencil(Func|Op|Mask)\w*|" \
+                       r"Viewport\w*|Scissor\w*|LineWidth|PointSize|PixelStore\w|" \
+                       r"Clear(Color|Depth\w*|Stencil)|Hint|LogicOp|ProvokingVertex|" \
+                       r"PrimitiveRestartIndex|PatchParameteri|SampleMask\w*|MinSampleShading"
+
+# parameters identifying which state a command sets (the others are its value)
+keyParams = [ "target", "index", "cap", "face", "unit", "pname", "first" ]
+
+# GL_ELEMENT_ARRAY_BUFFER, the binding of which is part of the vertex array
+elementArrayBuffer = 0x8893
+
+# TraceMetadata - commands of a module indexed by id, as written by
+# DGenerator.writeTraceMetadata
+class TraceMetadata:
+    def __init__(self, meta, stateCommands=defaultStateCommands):
+        self.api = meta["api"]
+        self.frameMarker = meta["frameMarker"]
+        self.commands = meta["commands"]
+        prefix = re.escape(self.api)
+        regex = re.compile("{}({})".format(prefix, stateCommands))
+        self.stateCommands = set()
+        for id, cmd in enumerate(self.commands):
+            if regex.fullmatch(cmd["name"]) != None and cmd["returns"] == "void" and \
+                    all(p["kind"] == "value" for p in cmd["params"]):
+                self.stateCommands.add(id)
+
+    @staticmethod
+    def load(filename, stateCommands=defaultStateCommands):
+        with open(filename, mode="r") as file:
+            return TraceMetadata(json.load(file), stateCommands)
+
+    def name(self, id):
+        return self.commands[id]["name"]
+
+# readTrace - calls of a trace file, as a list of frames, each a list of
+# (command id, tuple of argument words)
+# Raises ValueError if the trace does not match the metadata.
+def readTrace(filename, meta):
+    words = array('Q')
+    with open(filename, mode="rb") as file:
+        words.frombytes(file.read())
+    frames = [ [] ]
+    i = 0
+    while i < len(words):
+        id = words[i] & 0xffffffff
+        argc = words[i] >> 32
+        if id == meta.frameMarker:
+            frames.append([])
+            i += 1
+            continue
+        if id >= len(meta.commands) or argc != len(meta.commands[id]["params"]) or \
+                i + 1 + argc > len(words):
+            raise ValueError("{}: invalid record at word {}".format(filename, i))
+        frames[-1].append((id, tuple(words[i+1:i+1+argc])))
+        i += 1 + argc
+    if len(frames) > 1 and not len(frames[-1]):
+        frames.pop()
+    return frames
+
+# StateTracker - follows the states set by the calls of a trace
+class StateTracker:
+    def __init__(self, meta):
+        self.meta = meta
+        # state key -> value
+        self.states = {}
+        self.activeTexture = None
+        self.vertexArray = None
+
+    # stateOf - (key, value) of the state set by a call, or None if the
+    # call does not set a known state
+    def stateOf(self, id, args):
+        if id not in self.meta.stateCommands: return None
+        name = self.meta.name(id)[len(self.meta.api):]
+        params = [ p["name"] for p in self.meta.commands[id]["params"] ]
+        key = [ a for p, a in zip(params, args) if p in keyParams ]
+        value = tuple(a for p, a in zip(params, args) if p not in keyParams)
+        for prefix in [ "Enable", "Disable" ]:
+            if name.startswith(prefix):
+                # glEnable and glDisable set the same state
+                name = "Enable" + name[len(prefix):]
+                key = list(args)
+                value = prefix == "Enable"
+        # states held by the active texture unit or the bound vertex array
+        if name == "BindTexture":
+            key.append(self.activeTexture)
+        if name == "EnableVertexAttribArray" or \
+                (name.startswith("BindBuffer") and len(args) and args[0] == elementArrayBuffer):
+            key.append(self.vertexArray)
+        return (name, tuple(key)), value
+
+    # call - follow a call. Returns the key of the state it sets and whether
+    # it set it to the value it already had, or (None, False).
+    def call(self, id, args):
+        state = self.stateOf(id, args)
+        if state == None: return None, False
+        key, value = state
+        if key[0] == "ActiveTexture": self.activeTexture = value[0]
+        if key[0] == "BindVertexArray": self.vertexArray = value[0]
+        redundant = key in self.states and self.states[key] == value
+        self.states[key] = value
+        return key, redundant
+
+# histogram - Counter of the calls per command and maximum per frame
+def histogram(frames):
+    total = Counter()
+    maxPerFrame = Counter()
+    for frame in frames:
+        calls = Counter(id for id, args in frame)
+        total.update(calls)
+        for id, n in calls.items():
+            maxPerFrame[id] = max(maxPerFrame[id], n)
+    return total, maxPerFrame
+
+# analyzeStates - redundant calls per command, and changes of each state
+# per frame (Counter per frame)
+def analyzeStates(frames, meta):
+    tracker = StateTracker(meta)
+    redundant = Counter()
+    changes = []
+    for frame in frames:
+        frameChanges = Counter()
+        for id, args in frame:
+            key, isRedundant = tracker.call(id, args)
+            if isRedundant:
+                redundant[id] += 1
+            elif key != None:
+                frameChanges[key] += 1
+        changes.append(frameChanges)
+    return redundant, changes
+
+def formatKey(key):
+    name, args = key
+    return "{}({})".format(name, ", ".join("-" if a == None else "0x{:x}".format(a) for a in args))
+
+def printHistogram(frames, meta, top):
+    total, maxPerFrame = histogram(frames)
+    n = max(len(frames), 1)
+    print("{} frame(s), {:.1f} calls per frame".format(len(frames), sum(total.values()) / n))
+    print("{:48}{:>12}{:>12}{:>12}".format("command", "calls", "per frame", "max frame"))
+    for id, calls in total.most_common(top):
+        print("{:48}{:12d}{:12.1f}{:12d}".format(meta.name(id), calls, calls / n, maxPerFrame[id]))
+
+def printRedundant(frames, meta, top):
+    total, maxPerFrame = histogram(frames)
+    redundant, changes = analyzeStates(frames, meta)
+    print("{} redundant state change(s) out of {} call(s)".format(
+            sum(redundant.values()), sum(total.values())))
+    print("{:48}{:>12}{:>12}".format("command", "redundant", "% of calls"))
+    for id, n in redundant.most_common(top):
+        print("{:48}{:12d}{:12.0%}".format(meta.name(id), n, n / total[id]))
+
+def printThrash(frames, meta, top):
+    redundant, changes = analyzeStates(frames, meta)
+    total = Counter()
+    maxPerFrame = Counter()
+    for frameChanges in changes:
+        total.update(frameChanges)
+        for key, n in frameChanges.items():
+            maxPerFrame[key] = max(maxPerFrame[key], n)
+    n = max(len(frames), 1)
+    print("{:60}{:>12}{:>12}".format("state", "changes", "max frame"))
+    for key, changes in total.most_common(top):
+        print("{:60}{:12.1f}{:12d}".format(formatKey(key), changes / n, maxPerFrame[key]))
+
+reports = {
+    "histogram": printHistogram,
+    "redundant": printRedundant,
+    "thrash": printThrash,
+}
+
+if __name__ == "__main__":
+
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Analyze a call trace of the generated bindings')
+    parser.add_argument('trace', help="Trace file (words returned by glTraceTake)")
+    parser.add_argument('metadata', help="Metadata of the traced module (e.g. gl.trace.json)")
+    parser.add_argument('--report', dest='reports', nargs="*", choices=list(reports),
+                        default=list(reports), help="Reports to print [all]")
+    parser.add_argument('--top', dest='top', type=int, default=20,
+                        help="Number of lines of each report [20]")
+    parser.add_argument('--state-commands', dest='stateCommands', default=defaultStateCommands,
+                        help="Regex matching the commands setting a state, without the API "
+                             "prefix [binds, enables, blend, depth, stencil... states]")
+    args = parser.parse_args()
+
+    meta = TraceMetadata.load(args.metadata, args.stateCommands)
+    try:
+        frames = readTrace(args.trace, meta)
+    except ValueError as ex:
+        print("error: {}".format(ex), file=sys.stderr)
+        sys.exit(1)
+
+    for i, r in enumerate(args.reports):
+        if i != 0: print()
+        reports[r](frames, meta, args.top)